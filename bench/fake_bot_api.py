@@ -0,0 +1,108 @@
+# Minimal Telegram Bot API stand-in served over HTTP on localhost.
+#
+#   api = FakeBotAPI("1:bench")
+#   base = await api.start()                 # e.g. http://127.0.0.1:40123
+#   ApplicationBuilder().token("1:bench").base_url(f"{base}/bot")
+#
+# or run demo.py against it with BOT_API_URL=<base>.  Updates pushed with
+# push() are served to getUpdates (long polling); every other method gets a
+# minimal valid result and is reported to the listeners, which is how the
+# load harness measures delivery latency.
+
+import asyncio
+import itertools
+import json
+import socket
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+
+def _parse(value: str):
+    """PTB sends every parameter as a form field holding a JSON value (or a bare string)."""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class FakeBotAPI:
+    def __init__(self, token: str, host: str = "127.0.0.1"):
+        self.token = token
+        self.host = host
+        self.calls: Counter = Counter()
+        self.listeners: list = []          # fn(method, params, monotonic_time)
+        self._updates: deque = deque()
+        self._has_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+        self._runner: web.AppRunner | None = None
+
+    # ── driving side ────────────────────────────────────────
+    def push(self, update: dict) -> int:
+        """Queue a raw update (``update_id`` is filled in) for the next getUpdates."""
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._has_updates.set()
+        return update["update_id"]
+
+    # ── server ──────────────────────────────────────────────
+    async def start(self, port: int = 0) -> str:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((self.host, port))
+        await web.SockSite(self._runner, sock).start()
+        return f"http://{self.host}:{sock.getsockname()[1]}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request):
+        if request.match_info["token"] != self.token:
+            return web.json_response({"ok": False, "error_code": 401, "description": "Unauthorized"}, status=401)
+        method = request.match_info["method"]
+        params = {k: _parse(v) for k, v in (await request.post()).items() if isinstance(v, str)}
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        else:
+            now = time.monotonic()
+            for listener in self.listeners:
+                listener(method, params, now)
+            result = self._result(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params):
+        if not self._updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get("timeout", 0)))
+            except asyncio.TimeoutError:
+                pass
+        limit = min(int(params.get("limit", 100)), len(self._updates))
+        return [self._updates.popleft() for _ in range(limit)]
+
+    def _message(self, params, **extra):
+        chat_id = params.get("chat_id", 0)
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, **extra}
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": int(self.token.split(":")[0]), "is_bot": True,
+                    "first_name": "Fake", "username": "fake_bot"}
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method == "sendMediaGroup":
+            return [self._message(params) for _ in params.get("media", [])]
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if method.startswith("send"):
+            return self._message(params)
+        return True
@@ -0,0 +1,295 @@
+# Load benchmark: thousands of virtual users against demo.py over HTTP.
+#
+#   python bench/load.py --users 2000 --cycles 3 --relays 5
+#
+# Starts FakeBotAPI on localhost, builds the real application with
+# demo.build_application (BOT_API_URL points it at the fake server) and runs
+# it with long polling, exactly like production.  Every virtual user goes
+#   /start → gender → language (search) → [match → K relays → /next] × cycles → match
+# while one admin clicks through the stats / report views.  The run is timed
+# from the first search to the last match, after every user has seen the match
+# (or timed out waiting for it) that follows their final /next.
+#
+# Reported:
+#   matches/sec, relay latency p50/p99 (update queued → copyMessage seen),
+#   search wait p50/p90/p99/max, memory per 10k onboarded users (tracemalloc),
+#   and per-call p50/p99 of find_partner, message_handler, admin_callback.
+# Each run is appended to bench/results.jsonl with the git commit, and the
+# last stored run with the same parameters is printed next to it.
+
+import argparse
+import asyncio
+import functools
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+TOKEN = "123456:bench"
+RESULTS = os.path.join(HERE, "results.jsonl")
+MATCH_PREFIX = "✨ You've got a match!"
+REPORTED_METRICS = ("matches_per_sec", "relay_p50_ms", "relay_p99_ms", "wait_p50_ms", "wait_p99_ms",
+                    "mem_per_10k_mb", "find_partner_p99_us", "message_handler_p99_us", "admin_callback_p99_us")
+
+
+def pct(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Harness:
+    def __init__(self, api: FakeBotAPI, users: int):
+        self.api = api
+        self.ids = itertools.count(1)
+        self.measuring = False
+        self.matched = {uid: asyncio.Event() for uid in range(1, users + 1)}
+        self.search_since = dict.fromkeys(self.matched, 0.0)
+        self.waiting_notices = 0
+        self.onboarded = asyncio.Event()
+        self.relay_sent: dict[tuple[int, int], float] = {}
+        self.relay_ms: list[float] = []
+        self.wait_ms: list[float] = []
+        self.matches = 0
+        self.last_match = 0.0
+        self.timeouts = 0
+        api.listeners.append(self.on_call)
+
+    # ── what the bot sends ──────────────────────────────────
+    def on_call(self, method, params, now):
+        if method == "copyMessage":
+            sent = self.relay_sent.pop((params["from_chat_id"], params["message_id"]), None)
+            if sent is not None:
+                self.relay_ms.append((now - sent) * 1000)
+        elif method == "sendMessage":
+            text, uid = params.get("text", ""), params.get("chat_id")
+            if text.startswith(MATCH_PREFIX) and uid in self.matched:
+                if self.measuring:
+                    self.matches += 1
+                    self.last_match = now
+                    self.wait_ms.append((now - self.search_since[uid]) * 1000)
+                self.matched[uid].set()
+            elif text.startswith("⏳ Waiting for a partner") and not self.onboarded.is_set():
+                self.waiting_notices += 1
+
+    # ── what users send ─────────────────────────────────────
+    def message(self, uid, text, track=False):
+        msg_id = next(self.ids)
+        msg = {"message_id": msg_id, "date": int(time.time()), "text": text,
+               "chat": {"id": uid, "type": "private"},
+               "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}"}}
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if track:
+            self.relay_sent[(uid, msg_id)] = time.monotonic()
+        self.api.push({"message": msg})
+
+    def callback(self, uid, data):
+        self.api.push({"callback_query": {
+            "id": str(next(self.ids)), "chat_instance": str(uid), "data": data,
+            "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}"},
+            "message": {"message_id": next(self.ids), "date": int(time.time()), "text": "menu",
+                        "chat": {"id": uid, "type": "private"}}}})
+
+    def search(self, uid):
+        self.matched[uid].clear()
+        self.search_since[uid] = time.monotonic()
+
+
+async def virtual_user(h: Harness, uid: int, args):
+    h.message(uid, "/start")
+    h.callback(uid, "set_gender:Male" if uid % 2 else "set_gender:Female")
+    h.search(uid)
+    h.callback(uid, "set_lang:en")
+    await h.onboarded.wait()
+
+    for cycle in range(args.cycles + 1):
+        try:
+            await asyncio.wait_for(h.matched[uid].wait(), args.match_timeout)
+        except asyncio.TimeoutError:
+            h.timeouts += 1
+            return
+        if cycle == args.cycles:      # the match after the final /next closes the run
+            return
+        for k in range(args.relays):
+            await asyncio.sleep(args.think)
+            h.message(uid, f"hello {k}", track=True)
+        await asyncio.sleep(args.think)
+        if random.random() < args.report_rate:
+            h.callback(uid, "report:open")
+            h.callback(uid, "rep_reason:Vulgar")
+        h.search(uid)
+        h.message(uid, "/next")
+
+
+async def admin_user(h: Harness, admin_id: int, stop: asyncio.Event):
+    views = itertools.cycle(("admin:stats", "rep_filter:all", "rep_filter:7d", "rep_filter:3+"))
+    while not stop.is_set():
+        h.callback(admin_id, next(views))
+        await asyncio.sleep(0.2)
+
+
+def instrument(demo, times):
+    """Wrap the handlers under regression watch with a wall-clock timer."""
+    def timed(name, fn):
+        samples = times[name]
+
+        @functools.wraps(fn)
+        async def wrapper(*a, **kw):
+            t = time.perf_counter()
+            try:
+                return await fn(*a, **kw)
+            finally:
+                samples.append((time.perf_counter() - t) * 1e6)
+        return wrapper
+
+    # find_partner is looked up as a module global at call time; the other two
+    # are bound when register_handlers runs, so this must happen before that
+    for name in ("find_partner", "message_handler", "admin_callback"):
+        setattr(demo, name, timed(name, getattr(demo, name)))
+
+
+async def run(args) -> dict:
+    api = FakeBotAPI(TOKEN)
+    base = await api.start()
+
+    tmp = tempfile.mkdtemp(prefix="gabbar-load-")
+    os.environ.update(BOT_API_URL=base, DB_PATH=os.path.join(tmp, "db"), JOURNAL_DIR=os.path.join(tmp, "journal"),
+                      CONCURRENT_UPDATES=str(args.concurrent), MATCH_TICK_MS=str(args.tick_ms))
+    if not args.telegram_limits:
+        # the fake API has no flood limits; keep the scheduler in the path but never throttle
+        os.environ.update(GLOBAL_MSG_PER_SEC="1e9", CHAT_MSG_PER_SEC="1e9", CHAT_BURST="1e9")
+    logging.disable(logging.WARNING)
+    import demo
+
+    times = defaultdict(list)
+    instrument(demo, times)
+    demo.load_state()
+    app = demo.build_application(TOKEN)
+    h = Harness(api, args.users)
+    admin_id = demo.admins[0]
+
+    async with app:
+        await demo.on_startup(app)
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+
+        # ── phase 1: onboarding, measured for memory ────────────
+        # the language pick is every user's first search, so matches are
+        # counted from here; handler timings start with phase 2
+        gc.collect()
+        tracemalloc.start()
+        base_mem = tracemalloc.get_traced_memory()[0]
+        h.measuring = True
+        start = time.monotonic()
+        users = [asyncio.create_task(virtual_user(h, uid, args)) for uid in range(1, args.users + 1)]
+        while h.waiting_notices < args.users:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)              # let the store / journal flush their buffers
+        gc.collect()
+        mem = tracemalloc.get_traced_memory()[0] - base_mem
+        tracemalloc.stop()
+
+        # ── phase 2: match / relay / next cycles ────────────────
+        for samples in times.values():       # the wrappers hold these lists, so empty in place
+            samples.clear()
+        stop_admin = asyncio.Event()
+        admin = asyncio.create_task(admin_user(h, admin_id, stop_admin))
+        h.onboarded.set()
+        await asyncio.gather(*users)
+        elapsed = (h.last_match or time.monotonic()) - start
+        h.measuring = False
+        stop_admin.set()
+        await admin
+
+        await app.updater.stop()
+        await app.stop()
+        await demo.on_shutdown(app)
+    await api.stop()
+
+    metrics = {
+        "matches_per_sec": h.matches / 2 / elapsed,
+        "relay_p50_ms": pct(h.relay_ms, 0.50), "relay_p99_ms": pct(h.relay_ms, 0.99),
+        "wait_p50_ms": pct(h.wait_ms, 0.50), "wait_p90_ms": pct(h.wait_ms, 0.90),
+        "wait_p99_ms": pct(h.wait_ms, 0.99), "wait_max_ms": max(h.wait_ms, default=0.0),
+        "mem_per_10k_mb": mem / args.users * 10_000 / 2**20,
+        "elapsed_s": elapsed, "relays": len(h.relay_ms), "match_timeouts": h.timeouts,
+        "api_calls": sum(api.calls.values()),
+    }
+    for name, samples in times.items():
+        metrics[f"{name}_calls"] = len(samples)
+        metrics[f"{name}_p50_us"] = pct(samples, 0.50)
+        metrics[f"{name}_p99_us"] = pct(samples, 0.99)
+    return metrics
+
+
+def previous_run(params: dict):
+    if not os.path.exists(RESULTS):
+        return None
+    last = None
+    with open(RESULTS) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["params"] == params:
+                last = entry
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark against a local fake Bot API")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--relays", type=int, default=5, help="messages relayed per match")
+    parser.add_argument("--think", type=float, default=0.05, help="seconds between a user's messages")
+    parser.add_argument("--report-rate", type=float, default=0.05, help="share of chats that end in a report")
+    parser.add_argument("--match-timeout", type=float, default=30.0)
+    parser.add_argument("--concurrent", type=int, default=0, help="CONCURRENT_UPDATES for the bot")
+    parser.add_argument("--tick-ms", type=int, default=0, help="MATCH_TICK_MS for the bot")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the real outbound rate limits")
+    parser.add_argument("--no-save", action="store_true", help="don't append to bench/results.jsonl")
+    args = parser.parse_args()
+
+    params = {k: v for k, v in vars(args).items() if k != "no_save"}
+    metrics = asyncio.run(run(args))
+    prev = previous_run(params)
+    commit = git_commit()
+
+    print(f"commit {commit}  " + " ".join(f"{k}={v}" for k, v in params.items()))
+    for key, value in metrics.items():
+        line = f"  {key:<26} {value:>12.2f}" if isinstance(value, float) else f"  {key:<26} {value:>12}"
+        if prev and key in REPORTED_METRICS and prev["metrics"].get(key):
+            line += f"   {(value / prev['metrics'][key] - 1) * 100:+6.1f}% vs {prev['commit']}"
+        print(line)
+
+    if not args.no_save:
+        with open(RESULTS, "a") as f:
+            f.write(json.dumps({"commit": commit, "time": datetime.utcnow().isoformat(timespec="seconds"),
+                                "params": params, "metrics": metrics}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Memory per user: the old dict-per-user profiles vs profiles.ProfileStore.
+#
+#   python bench/profile_memory.py --users 1000000
+#
+# Builds the same random population both ways and measures it with
+# tracemalloc: everything allocated while building, except the uid ints
+# themselves, which both variants share.
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+from datetime import date, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from profiles import ProfileStore  # noqa: E402
+
+GENDERS = ("Male", "Female", "Other")
+LANGUAGES = ("hi", "en", "ja", "ko", "id", "zh", "ru")
+
+
+def population(n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    today = date.today()
+    days = [(today - timedelta(days=d)).isoformat() for d in range(365)]
+    for i in range(n):
+        uid = 1_000_000_000 + rnd.randrange(5_000_000_000)   # real Telegram ids don't fit small ints
+        profile = {"created": rnd.choice(days), "gender": rnd.choice(GENDERS), "language": rnd.choice(LANGUAGES)}
+        if rnd.random() < 0.6:
+            profile["age"] = rnd.randrange(10, 89)
+        yield uid, profile
+
+
+def measure(build, rows) -> int:
+    gc.collect()
+    tracemalloc.start()
+    obj = build(rows)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return used
+
+
+def build_dicts(rows):
+    # stored profiles come back from SQLite as fresh dicts and strings, as here
+    return {uid: json.loads(json.dumps(p)) for uid, p in rows}
+
+
+def build_store(rows):
+    store = ProfileStore(GENDERS, LANGUAGES)
+    for uid, p in rows:
+        store.load(uid, p)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per user: dict profiles vs ProfileStore")
+    parser.add_argument("--users", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rows = list(population(args.users))
+    results = {"dict": measure(build_dicts, rows), "ProfileStore": measure(build_store, rows)}
+
+    print(f"users={args.users}")
+    for name, used in results.items():
+        print(f"  {name:<14} {used / args.users:8.1f} B/user   {used / 2**20:8.1f} MiB total")
+    print(f"  reduction      {results['dict'] / results['ProfileStore']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
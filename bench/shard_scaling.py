@@ -0,0 +1,198 @@
+# Throughput scaling of the sharded deployment (shard.py) across cores.
+#
+#   python bench/shard_scaling.py --workers 1 2 4 --users 400
+#
+# For each worker count this starts a real Coordinator, N worker processes
+# running demo.py's handlers, and routes a scripted workload through the
+# coordinator exactly like the production router does:
+#   /start → set_gender → set_lang (→ match) → K text relays → /next
+# Bot API calls are answered in-process by FakeRequest, so the numbers are
+# pure bot CPU + coordinator IPC.  Prints updates/sec and speed-up vs. 1 worker.
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram.request import BaseRequest  # noqa: E402
+
+
+class FakeRequest(BaseRequest):
+    """Answers every Bot API call locally with a minimal valid result."""
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        chat_id = params.get("chat_id", 1)
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif endpoint == "copyMessage":
+            result = {"message_id": 1}
+        elif endpoint.startswith(("send", "edit")):
+            result = {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"},
+                      "text": params.get("text", "")}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# ─────────────  workload  ─────────────
+def _user(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+
+def _chat(uid):
+    return {"id": uid, "type": "private"}
+
+
+def script_for(uid: int, relays: int, ids):
+    """Raw updates one virtual user sends, in order."""
+    def message(text, entities=None):
+        msg = {"message_id": next(ids), "date": 0, "chat": _chat(uid), "from": _user(uid), "text": text}
+        if entities:
+            msg["entities"] = entities
+        return {"update_id": next(ids), "message": msg}
+
+    def callback(data):
+        return {"update_id": next(ids), "callback_query": {
+            "id": str(next(ids)), "from": _user(uid), "chat_instance": str(uid), "data": data,
+            "message": {"message_id": next(ids), "date": 0, "chat": _chat(uid), "text": "menu"}}}
+
+    command = [{"type": "bot_command", "offset": 0, "length": 0}]
+    out = [message("/start", [dict(command[0], length=6)]),
+           callback("set_gender:Male" if uid % 2 else "set_gender:Female"),
+           callback("set_lang:en")]
+    out += [message(f"hello {i}") for i in range(relays)]
+    out.append(message("/next", [dict(command[0], length=5)]))
+    return out
+
+
+# ─────────────  worker process  ─────────────
+def worker_main(shard: int, workers: int, socket_path: str, expected: int, done_q):
+    tmp = tempfile.mkdtemp(prefix=f"gabbar-bench-{shard}-")
+    os.environ.update(SHARD_SOCKET=socket_path, SHARD_ID=str(shard), SHARD_COUNT=str(workers),
+                      DB_PATH=os.path.join(tmp, "db"), JOURNAL_DIR=os.path.join(tmp, "journal"))
+    import logging
+    logging.disable(logging.WARNING)
+    import demo
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, TypeHandler
+
+    async def run():
+        demo.load_state()        # empty temp DB; profiles are read back through the store
+        # the fake API has no flood limits, so open the buckets up; calls still go
+        # through the lane scheduler like in production
+        unlimited = demo.LaneRateLimiter(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+        app = ApplicationBuilder().token("1:bench").request(FakeRequest()).rate_limiter(unlimited).build()
+        demo.register_handlers(app)
+        processed = 0
+        finished = asyncio.Event()
+
+        async def count(update, context):
+            nonlocal processed
+            processed += 1
+            if processed >= expected:
+                finished.set()
+
+        # last group, so it runs once demo's handlers are done with the update
+        app.add_handler(TypeHandler(Update, count), group=99)
+
+        async def on_update(data):
+            # same path as demo.serve_shard: never block the coordinator reader
+            await app.update_queue.put(Update.de_json(data, app.bot))
+
+        async with app:
+            await app.start()
+            await demo.shard_client.connect(demo.apply_shard_event, on_update)
+            done_q.put(("ready", shard))
+            await finished.wait()
+            done_q.put(("done", shard))
+            await demo.shard_client.close()
+            await app.stop()
+
+    asyncio.run(run())
+
+
+# ─────────────  driver  ─────────────
+async def run_once(workers: int, users: int, relays: int) -> float:
+    import itertools
+    from shard import Coordinator
+
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="gabbar-coord-"), "c.sock")
+    coordinator = Coordinator(None)
+    server = await coordinator.serve(socket_path)
+
+    ids = itertools.count(1)
+    scripts = [script_for(uid, relays, ids) for uid in range(1000, 1000 + users)]
+    expected = {s: 0 for s in range(workers)}
+    for uid, script in zip(range(1000, 1000 + users), scripts):
+        expected[uid % workers] += len(script)
+
+    ctx = mp.get_context("spawn")
+    done_q = ctx.Queue()
+    procs = []
+    for shard in range(workers):
+        p = ctx.Process(target=worker_main, args=(shard, workers, socket_path, expected[shard], done_q))
+        p.start()
+        procs.append(p)
+
+    loop = asyncio.get_running_loop()
+    for _ in range(workers):
+        await loop.run_in_executor(None, done_q.get)
+    while len(coordinator.workers) < workers:
+        await asyncio.sleep(0.01)
+
+    # interleave users like real traffic: step k of every script, then step k+1, …
+    total = sum(expected.values())
+    start = time.perf_counter()
+    for step in itertools.zip_longest(*scripts):
+        for uid, upd in zip(range(1000, 1000 + users), step):
+            if upd is not None:
+                coordinator.route(uid % workers, upd)
+        for writer in coordinator.workers.values():
+            await writer.drain()
+
+    for _ in range(workers):
+        await loop.run_in_executor(None, done_q.get)
+    elapsed = time.perf_counter() - start
+
+    for p in procs:
+        p.join(timeout=5)
+    while coordinator.workers:           # let handle() see EOF before the loop closes
+        await asyncio.sleep(0.01)
+    server.close()
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--relays", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"cores={os.cpu_count()} users={args.users} relays/user={args.relays}")
+    print(f"{'workers':>8} {'updates/s':>12} {'speed-up':>9}")
+    base = None
+    for n in args.workers:
+        rate = asyncio.run(run_once(n, args.users, args.relays))
+        base = base or rate
+        print(f"{n:>8} {rate:>12.0f} {rate / base:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
 # ✅ Final Full Version of Gabbar Chat Bot
 # Includes all features: gender, language, optional age, full commands, reporting, and admin panel.
 
+import asyncio
+import copy
+import heapq
+import hmac
 import logging
+import os
 import random
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
+import signal
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from itertools import count
+from aiohttp import web
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove, InputMediaAudio,
+                      InputMediaDocument, InputMediaPhoto, InputMediaVideo)
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from telegram.ext import (Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes,
-                          ConversationHandler, CallbackQueryHandler)
+                          ConversationHandler, CallbackQueryHandler, TypeHandler, ApplicationHandlerStop,
+                          BaseRateLimiter, BaseUpdateProcessor)
+
+from metrics import registry, timed
+from profiler import SamplingProfiler
+from profiles import ProfileStore
+from shard import ShardClient, ShardWaitSet
+from storage import Journal, StateStore
+from timerwheel import TimerWheel
+from timeseries import TimeSeries
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,78 +37,1035 @@ logger = logging.getLogger(__name__)
 # States
 GENDER, LANGUAGE, AGE, TYPING_LANGUAGE = range(4)
 
+# ─────────────  Match-making queue  ─────────────
+class MatchQueue:
+    """FIFO wait-pool bucketed by (language, gender).
+
+    Add, remove, membership and pop are all O(1): every bucket is an
+    OrderedDict of ``uid -> (enqueue seq, enqueue time)`` and ``_where`` remembers which bucket
+    a user sits in.  The number of buckets is bounded by LANGUAGES x genders,
+    so comparing bucket heads to find the longest waiter is constant work.
+    """
+
+    def __init__(self):
+        self._buckets: dict[tuple[str, str], OrderedDict] = {}
+        self._where: dict[int, tuple[str, str]] = {}
+        self._seq = count()
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, uid):
+        return uid in self._where
+
+    def __iter__(self):
+        return iter(tuple(self._where))
+
+    def add(self, uid: int, language: str, gender: str):
+        if uid in self._where:
+            return
+        key = (language, gender)
+        self._buckets.setdefault(key, OrderedDict())[uid] = (next(self._seq), time.monotonic())
+        self._where[uid] = key
+
+    def remove(self, uid: int) -> bool:
+        key = self._where.pop(uid, None)
+        if key is None:
+            return False
+        del self._buckets[key][uid]
+        return True
+
+    def _oldest(self, language: str | None, avoid):
+        """``(key, uid)`` of the longest waiter not ``avoid``-ed, or None.
+
+        ``avoid`` only ever matches a handful of recent partners, so each
+        bucket scan stops after a few entries.
+        """
+        best, best_seq = None, None
+        for key, bucket in self._buckets.items():
+            if not bucket or (language is not None and key[0] != language):
+                continue
+            for uid, (seq, _) in bucket.items():
+                if avoid is None or not avoid(uid):
+                    if best_seq is None or seq < best_seq:
+                        best, best_seq = (key, uid), seq
+                    break
+        return best
+
+    def pop_partner(self, language: str | None = None, skip=None, avoid=None) -> tuple[int, float] | None:
+        """Pop the longest-waiting user, preferring the same language.
+
+        Returns ``(uid, seconds waited)``.  Users for which ``skip(uid)`` is
+        true are dropped from the queue; users for which ``avoid(uid)`` is
+        true are passed over but stay.
+        """
+        while True:
+            found = self._oldest(language, avoid) or self._oldest(None, avoid)
+            if found is None:
+                return None
+            key, uid = found
+            _, since = self._buckets[key].pop(uid)
+            del self._where[uid]
+            if skip is None or not skip(uid):
+                return uid, time.monotonic() - since
+
+    def bucket_sizes(self) -> dict[tuple[str, str], int]:
+        return {key: len(bucket) for key, bucket in self._buckets.items()}
+
+    def entries(self):
+        """Yield ``(uid, language, enqueued_at)`` for everyone waiting, oldest first per bucket."""
+        for (language, _), bucket in self._buckets.items():
+            for uid, (_, since) in bucket.items():
+                yield uid, language, since
+
+
+class RecentPartners:
+    """Each user's last few partners, kept in a fixed-size ring.
+
+    One list per user, ``[next slot, partner × size, paired-at × size]``, so
+    memory per user is bounded no matter how many chats they go through and
+    ``seen`` scans at most ``size`` ids.  A partner counts as recent for
+    ``cooldown`` seconds, after which the pair may be matched again.
+    """
+
+    def __init__(self, size: int, cooldown: float):
+        self.size = size
+        self.cooldown = cooldown
+        self._rings: dict[int, list] = {}
+
+    def __len__(self):
+        return len(self._rings)
+
+    def _find(self, ring: list, partner: int) -> int | None:
+        try:
+            return ring.index(partner, 1, 1 + self.size)
+        except ValueError:
+            return None
+
+    def add(self, uid: int, partner: int):
+        ring = self._rings.get(uid)
+        if ring is None:
+            ring = self._rings[uid] = [0] + [None] * self.size + [0.0] * self.size
+        i = ring[0]
+        old = self._find(ring, partner)
+        if old is not None:
+            # one slot per partner: the oldest entry moves into the duplicate's
+            # slot, and the head slot it leaves takes the new entry
+            ring[old], ring[old + self.size] = ring[1 + i], ring[1 + self.size + i]
+        ring[1 + i] = partner
+        ring[1 + self.size + i] = time.monotonic()
+        ring[0] = (i + 1) % self.size
+
+    def last(self, uid: int) -> int | None:
+        """Most recent partner (for reports), however long ago."""
+        ring = self._rings.get(uid)
+        return None if ring is None else ring[1 + (ring[0] - 1) % self.size]
+
+    def seen(self, uid: int, other: int) -> bool:
+        """True if ``other`` was one of ``uid``'s partners within the cooldown."""
+        ring = self._rings.get(uid)
+        if ring is None:
+            return False
+        i = self._find(ring, other)
+        return i is not None and time.monotonic() - ring[i + self.size] < self.cooldown
+
+    def recent(self, uid: int) -> list[int]:
+        """Partners still inside the cooldown (sent along with shard finds)."""
+        ring = self._rings.get(uid)
+        if ring is None:
+            return []
+        now = time.monotonic()
+        return [p for p, t in zip(ring[1:1 + self.size], ring[1 + self.size:])
+                if p is not None and now - t < self.cooldown]
+
+    def forget(self, uid: int):
+        self._rings.pop(uid, None)
+
+
+# ─────────────  Metrics  ─────────────
+# Hot-path instruments; the scrape-time gauges are registered next to the
+# web app (see /metrics).
+HANDLER_SECONDS   = registry.histogram("gabbar_handler_seconds", "Wall time per handler callback", ("handler",))
+API_SECONDS       = registry.histogram("gabbar_bot_api_seconds", "Bot API call latency by method", ("method",))
+MATCHES_TOTAL     = registry.counter("gabbar_matches_total", "Pairs made")
+RELAYS_TOTAL      = registry.counter("gabbar_relayed_messages_total", "Messages and albums relayed to a partner")
+RETRY_AFTER_TOTAL = registry.counter("gabbar_retry_after_total", "RetryAfter (flood wait) responses from Telegram")
+USER_LOADS_TOTAL  = registry.counter("gabbar_user_loads_total", "Evicted users loaded back from SQLite")
+EVICTIONS_TOTAL   = registry.counter("gabbar_user_evictions_total", "Idle users dropped from memory")
+IDLE_ENDED_TOTAL  = registry.counter("gabbar_idle_chats_ended_total", "Chats ended by the idle reaper")
+UNREACHABLE_TOTAL = registry.counter("gabbar_unreachable_total", "Sends that found the user unreachable (blocked the bot, deleted, …)")
+SKIPPED_SENDS_TOTAL = registry.counter("gabbar_skipped_sends_total", "Calls not made because the chat is known unreachable")
+
+
+# ─────────────  Rollups  ─────────────
+# Per-minute / per-hour / per-day history for the admin panel and /metrics
+# (see timeseries.py); kept across restarts in the journal snapshot.
+rollups = TimeSeries()
+TS_MATCHES   = rollups.series("matches", "Pairs made")
+TS_CHAT_SEC  = rollups.series("chat_seconds", "Chat length, match to /next or /stop")
+TS_CHAT_MSGS = rollups.series("chat_messages", "Messages relayed per chat")
+TS_WAIT_SEC  = rollups.series("wait_seconds", "Time in the search pool before a match")
+TS_REPORTS   = rollups.series("reports", "Reports filed")
+TREND_WINDOWS = {"1h": 3600, "24h": 86400, "7d": 7 * 86400}   # admin panel and /metrics
+
+# {uid: [matched_at, messages sent]} for users of this process who are in a chat
+chat_sessions: dict[int, list] = {}
+
+def open_sessions(a, b):
+    now = time.time()
+    for uid in (a, b):
+        if owns_user(uid) and uid not in chat_sessions:
+            chat_sessions[uid] = [now, 0]
+
+def close_sessions(a, b):
+    """Record a finished chat.  The side with the lower id counts the chat and
+    its length; the other side (maybe on another shard) only adds its messages."""
+    first = min(a, b)
+    for uid in (a, b):
+        session = chat_sessions.pop(uid, None)
+        if session is None:
+            continue
+        started, sent = session
+        TS_CHAT_MSGS.record(sent, count=int(uid == first))
+        if uid == first:
+            TS_CHAT_SEC.record(time.time() - started)
+
+
+# ─────────────  Outbound send scheduler  ─────────────
+# Every Bot API call that targets a chat goes through LaneRateLimiter (plugged
+# in via ApplicationBuilder.rate_limiter).  Callers pick a lane with
+# ``rate_limit_args=LANE_…``; unlabelled calls ride the relay lane.
+LANE_MATCH, LANE_RELAY, LANE_ADMIN = range(3)    # lower = sent first
+LANE_NAMES = ("match", "relay", "admin")
+
+GLOBAL_MSG_PER_SEC = float(os.getenv("GLOBAL_MSG_PER_SEC", "30"))
+CHAT_MSG_PER_SEC   = float(os.getenv("CHAT_MSG_PER_SEC", "1"))     # group chats only
+CHAT_BURST         = float(os.getenv("CHAT_BURST", "3"))
+LANE_SCAN_LIMIT    = 64     # throttled chats looked past per lane and pass
+
+def is_unreachable_error(exc) -> bool:
+    """The user blocked the bot, deleted the account, or the chat is gone."""
+    return isinstance(exc, Forbidden) or (isinstance(exc, BadRequest) and "chat not found" in exc.message.lower())
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.stamp = capacity, time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def ready(self, now) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+    def wait_time(self, now) -> float:
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class LaneRateLimiter(BaseRateLimiter):
+    """Priority-lane scheduler for outbound Bot API calls.
+
+    Each lane is an OrderedDict of ``chat_id -> deque of jobs``; the
+    dispatcher serves the highest lane whose head chat has no request in
+    flight (which keeps per-chat order), as long as the global bucket allows.
+    Like PTB's AIORateLimiter, only group chats (negative ids) also need a
+    per-chat token: a private chat is held to the global rate alone, so a
+    burst of sends to one user doesn't stall the handler awaiting them.
+    RetryAfter pauses dispatching and puts the job back at the head of its
+    chat queue instead of failing the caller.
+
+    A Forbidden / "chat not found" reply puts the chat in ``unreachable``:
+    its queued jobs fail at once, later calls to it fail without an API
+    call, and ``on_unreachable(chat_id)`` runs.  Whoever owns the set
+    discards the chat again when the user shows signs of life.
+    """
+
+    def __init__(self, global_rate=GLOBAL_MSG_PER_SEC, chat_rate=CHAT_MSG_PER_SEC, chat_burst=CHAT_BURST,
+                 unreachable: set | None = None, on_unreachable=None):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate, self._chat_burst = chat_rate, chat_burst
+        self._chats: dict[int, TokenBucket] = {}
+        self._lanes = [OrderedDict() for _ in LANE_NAMES]
+        self._depth = [0] * len(LANE_NAMES)
+        self._in_flight: set = set()
+        self._sending: set[asyncio.Task] = set()    # _send tasks, so shutdown can cancel them
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self.retry_after_count = 0
+        self.unreachable = set() if unreachable is None else unreachable
+        self.on_unreachable = on_unreachable
+
+    async def initialize(self):
+        self._worker = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        """Stop dispatching; every call still queued or in flight fails instead of hanging."""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        sending = list(self._sending)
+        for task in sending:
+            task.cancel()
+        await asyncio.gather(*sending, return_exceptions=True)
+        closed = TelegramError("Rate limiter shut down")
+        for lane, chats in enumerate(self._lanes):
+            for jobs in chats.values():
+                for job in jobs:
+                    if not job[-1].done():
+                        job[-1].set_exception(closed)
+            chats.clear()
+            self._depth[lane] = 0
+
+    def depth(self) -> dict[str, int]:
+        return dict(zip(LANE_NAMES, self._depth))
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:               # answerCallbackQuery, getMe, setWebhook, …
+            return await self._call(endpoint, callback, args, kwargs)
+        if chat_id in self.unreachable:
+            SKIPPED_SENDS_TOTAL.inc()
+            raise Forbidden(f"Chat {chat_id} is unreachable (cached)")
+
+        lane = rate_limit_args if rate_limit_args in (LANE_MATCH, LANE_RELAY, LANE_ADMIN) else LANE_RELAY
+        fut = asyncio.get_running_loop().create_future()
+        self._lanes[lane].setdefault(chat_id, deque()).append((endpoint, callback, args, kwargs, fut))
+        self._depth[lane] += 1
+        self._wakeup.set()
+        return await fut
+
+    def _mark_unreachable(self, chat_id, exc):
+        UNREACHABLE_TOTAL.inc()
+        self.unreachable.add(chat_id)
+        for lane, chats in enumerate(self._lanes):
+            for job in chats.pop(chat_id, ()):
+                self._depth[lane] -= 1
+                if not job[-1].done():
+                    job[-1].set_exception(exc)
+        if self.on_unreachable:
+            self.on_unreachable(chat_id)
+
+    @staticmethod
+    def _is_group(chat_id) -> bool:
+        # "@channel" usernames and negative ids; users have positive ids
+        return isinstance(chat_id, str) or chat_id < 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def _pick(self, now):
+        """Return ``((lane, chat_id), 0)`` for the next sendable job, else ``(None, wait)``."""
+        wait = None
+        for lane, chats in enumerate(self._lanes):
+            for _ in range(min(len(chats), LANE_SCAN_LIMIT)):
+                chat_id = next(iter(chats))
+                if chat_id not in self._in_flight:
+                    if not self._is_group(chat_id):
+                        return (lane, chat_id), 0
+                    bucket = self._chat_bucket(chat_id)
+                    if bucket.ready(now):
+                        return (lane, chat_id), 0
+                    w = bucket.wait_time(now)
+                    wait = w if wait is None else min(wait, w)
+                chats.move_to_end(chat_id)
+        return None, wait
+
+    def _prune(self, now):
+        """Forget group-chat buckets that are full again and have nothing queued."""
+        queued = {c for chats in self._lanes for c in chats}
+        for chat_id in [c for c, b in self._chats.items()
+                        if c not in queued and c not in self._in_flight and b.wait_time(now) == 0
+                        and b.tokens >= b.capacity]:
+            del self._chats[chat_id]
+
+    async def _dispatch(self):
+        last_prune = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if not self._global.ready(now):
+                await asyncio.sleep(self._global.wait_time(now))
+                continue
+            if now - last_prune > 60:
+                self._prune(now)
+                last_prune = now
+
+            picked, wait = self._pick(now)
+            if picked is None:
+                self._wakeup.clear()
+                try:
+                    # woken by new jobs / finished sends, or when a chat token refills
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            lane, chat_id = picked
+            jobs = self._lanes[lane][chat_id]
+            job = jobs.popleft()
+            if not jobs:
+                del self._lanes[lane][chat_id]
+            self._depth[lane] -= 1
+            self._global.take()
+            if self._is_group(chat_id):
+                self._chat_bucket(chat_id).take()
+            self._in_flight.add(chat_id)
+            task = asyncio.create_task(self._send(lane, chat_id, job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    @staticmethod
+    async def _call(endpoint, callback, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            API_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+
+    async def _send(self, lane, chat_id, job):
+        endpoint, callback, args, kwargs, fut = job
+        try:
+            result = await self._call(endpoint, callback, args, kwargs)
+        except RetryAfter as exc:
+            self.retry_after_count += 1
+            RETRY_AFTER_TOTAL.inc()
+            self._paused_until = max(self._paused_until, time.monotonic() + exc.retry_after)
+            jobs = self._lanes[lane].setdefault(chat_id, deque())
+            jobs.appendleft(job)
+            self._lanes[lane].move_to_end(chat_id, last=False)
+            self._depth[lane] += 1
+        except Exception as exc:
+            if not fut.done():
+                fut.set_exception(exc)
+            if is_unreachable_error(exc) and chat_id not in self.unreachable:
+                self._mark_unreachable(chat_id, exc)
+        except asyncio.CancelledError:
+            if not fut.done():
+                fut.set_exception(TelegramError("Rate limiter shut down"))
+            raise
+        else:
+            if not fut.done():
+                fut.set_result(result)
+        finally:
+            self._in_flight.discard(chat_id)
+            self._wakeup.set()
+
+
+# ─────────────  Concurrency  ─────────────
+# CONCURRENT_UPDATES > 0 lets that many updates run at once.  Updates from the
+# same chat still run one after another, in arrival order; match/unmatch
+# transitions take per-user locks from pair_locks.
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "0"))
+
+class KeyedLocks:
+    """One asyncio.Lock per key, created on demand and dropped when idle.
+
+    ``async with locks(a, b):`` takes the keys in sorted order, so two tasks
+    locking the same pair can never deadlock.
+    """
+
+    def __init__(self):
+        self._locks: dict = {}     # key -> [Lock, users]
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def __call__(self, *keys):
+        entries = []
+        for key in sorted(set(keys)):
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            entries.append((key, entry))
+        held = []
+        try:
+            for _, entry in entries:
+                await entry[0].acquire()
+                held.append(entry)
+            yield
+        finally:
+            for entry in held:
+                entry[0].release()
+            for key, entry in entries:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+pair_locks = KeyedLocks()
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Concurrent update processing that keeps per-chat order.
+
+    The chat lock is taken *before* the concurrency semaphore, so a flooding
+    chat queues up behind itself instead of occupying every slot.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = KeyedLocks()
+
+    async def process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            return await super().process_update(update, coroutine)
+        async with self._chat_locks(chat.id):
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# ─────────────  Admission control  ─────────────
+# admission_gate runs in handler group -2, ahead of onboarding_gate and every
+# handler.  Each user has one token bucket per update kind; an update that
+# finds its bucket empty is dropped on the spot, so a flood never reaches
+# relay or matchmaking.  The sender is told to slow down at most once per
+# FLOOD_NOTICE_SEC.  WAITING_POOL_CAP bounds the search pool during surges.
+ADMIT_LIMITS = {                # kind: (tokens per second, burst)
+    "message":  (3, 20),        # burst covers a 10-part album plus typing
+    "command":  (1, 5),
+    "callback": (3, 10),
+}
+FLOOD_NOTICE_SEC = 10
+ADMIT_PRUNE_SEC  = 60           # how often idle buckets are dropped
+WAITING_POOL_CAP = int(os.getenv("WAITING_POOL_CAP", "0"))     # 0 = unlimited
+
+class AdmissionControl:
+    """Per-user, per-kind token buckets plus the throttle counters for /admin."""
+
+    def __init__(self, limits=ADMIT_LIMITS, notice_sec=FLOOD_NOTICE_SEC):
+        self.limits = limits
+        self.notice_sec = notice_sec
+        self._buckets: dict[tuple[int, str], TokenBucket] = {}
+        self._noticed: dict[int, float] = {}
+        self._last_prune = time.monotonic()
+        self.counts = {"message": 0, "command": 0, "callback": 0, "pool_full": 0}
+
+    @staticmethod
+    def kind(update: Update) -> str | None:
+        if update.callback_query:
+            return "callback"
+        msg = update.message
+        if msg is None:
+            return None
+        return "command" if msg.text and msg.text.startswith("/") else "message"
+
+    def admit(self, uid: int, kind: str, now: float) -> bool:
+        bucket = self._buckets.get((uid, kind))
+        if bucket is None:
+            bucket = self._buckets[(uid, kind)] = TokenBucket(*self.limits[kind])
+        if now - self._last_prune >= ADMIT_PRUNE_SEC:
+            self.prune(now)
+        if bucket.ready(now):
+            bucket.take()
+            return True
+        self.counts[kind] += 1
+        return False
+
+    def should_notice(self, uid: int, now: float) -> bool:
+        """True once per notice window for a throttled user."""
+        if now - self._noticed.get(uid, -self.notice_sec) < self.notice_sec:
+            return False
+        self._noticed[uid] = now
+        return True
+
+    def prune(self, now: float):
+        """Drop buckets that have refilled (same as a fresh one) and stale notices."""
+        self._last_prune = now
+        self._buckets = {k: b for k, b in self._buckets.items()
+                         if b.tokens + (now - b.stamp) * b.rate < b.capacity}
+        self._noticed = {u: t for u, t in self._noticed.items() if now - t < self.notice_sec}
+
+    def pool_full(self, pool_size: int) -> bool:
+        if WAITING_POOL_CAP and pool_size >= WAITING_POOL_CAP:
+            self.counts["pool_full"] += 1
+            return True
+        return False
+
+    @property
+    def throttled(self) -> int:
+        return self.counts["message"] + self.counts["command"] + self.counts["callback"]
+
+admission = AdmissionControl()
+
+async def admission_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is not None:
+        unreachable_users.discard(user.id)     # they're back (see Unreachable users)
+    kind = AdmissionControl.kind(update)
+    if user is None or kind is None or user.id in admins:
+        return
+    now = time.monotonic()
+    if admission.admit(user.id, kind, now):
+        return
+    if admission.should_notice(user.id, now):
+        if update.callback_query:
+            await update.callback_query.answer("🐢 Slow down!")
+        else:
+            await update.message.reply_text("🐢 Slow down! You're sending too fast, some messages were not delivered.")
+    raise ApplicationHandlerStop
+
+
+# ─────────────  Sorted indexes  ─────────────
+# Admin lists page through these with a cursor (the last key shown), so a
+# page costs one bisect plus a slice of page size, however long the list.
+_EPOCH = datetime(1970, 1, 1)
+
+def to_us(dt: datetime) -> int:
+    """Exact integer microseconds since the epoch (fits in callback_data)."""
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+def from_us(us: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=us)
+
+class SortedIndex:
+    """Sorted list of tuple keys; add/discard are a bisect plus a memmove."""
+
+    def __init__(self):
+        self._keys: list[tuple] = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key: tuple):
+        insort(self._keys, key)
+
+    def discard(self, key: tuple):
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def page(self, after: tuple | None, n: int) -> tuple[list[tuple], bool]:
+        """Up to ``n`` keys after the cursor ``after`` (None = from the start), and whether more follow."""
+        i = 0 if after is None else bisect_right(self._keys, after)
+        return self._keys[i:i + n], i + n < len(self._keys)
+
+
+# ─────────────  Report store  ─────────────
+REPORT_ALERT_MIN = 3      # open reports that put a user in the "3+" filter
+
+class ReportStore:
+    """Append-only report list with the indexes the admin views need.
+
+    ``reports`` is in arrival order, so a report's id is its list index.
+    ``_by_user`` maps a reported uid to its report ids and ``_open`` /
+    ``_last_open`` hold each user's live open count and newest open report.
+    Users with open reports are indexed two ways for the paged admin lists:
+    ``by_count`` as ``(-open count, uid)`` and ``by_recency`` as
+    ``(-newest open report µs, uid)``.  ``_open_pairs`` holds
+    ``(reporter, reported)`` for open reports, so a reporter can't pile up
+    reports against the same partner.
+    """
+
+    def __init__(self):
+        self.reports: list[dict] = []
+        self._by_user: dict[int, list[int]] = {}
+        self._open: dict[int, int] = {}
+        self._last_open: dict[int, int] = {}
+        self._open_pairs: set[tuple[int, int]] = set()
+        self.by_count = SortedIndex()
+        self.by_recency = SortedIndex()
+        self.open_total = 0
+
+    def __len__(self):
+        return len(self.reports)
+
+    def __iter__(self):
+        return iter(self.reports)
+
+    def add(self, report: dict) -> int:
+        rid = len(self.reports)
+        self.reports.append(report)
+        uid = report["reported"]
+        if uid is None:
+            return rid        # partner-less report from an old snapshot: keep the id, index nothing
+        self._by_user.setdefault(uid, []).append(rid)
+        if not report["handled"]:
+            n = self._open.get(uid, 0)
+            self.by_count.discard((-n, uid))
+            self.by_count.add((-(n + 1), uid))
+            self._open[uid] = n + 1
+            t, last = to_us(report["time"]), self._last_open.get(uid)
+            if last is None or t > last:
+                self.by_recency.discard((-(last or 0), uid))
+                self.by_recency.add((-t, uid))
+                self._last_open[uid] = t
+            self._open_pairs.add((report["reporter"], uid))
+            self.open_total += 1
+        return rid
+
+    def has_open(self, reporter: int, reported: int) -> bool:
+        return (reporter, reported) in self._open_pairs
+
+    def extend(self, reports):
+        for r in reports:
+            self.add(r)
+
+    def mark_handled(self, uid: int) -> list[int]:
+        """Close every open report against uid; return the ids that changed."""
+        changed = [i for i in self._by_user.get(uid, ()) if not self.reports[i]["handled"]]
+        for i in changed:
+            self.reports[i] = {**self.reports[i], "handled": True}    # new dict: snapshots share the old ones
+            self._open_pairs.discard((self.reports[i]["reporter"], uid))
+        self.open_total -= len(changed)
+        self.by_count.discard((-self._open.pop(uid, 0), uid))
+        self.by_recency.discard((-self._last_open.pop(uid, 0), uid))
+        return changed
+
+    def for_user(self, uid: int) -> list[dict]:
+        return [self.reports[i] for i in self._by_user.get(uid, ())]
+
+    def open_page(self, order: str, after: tuple | None, n: int,
+                  min_count: int = 1, since: datetime | None = None) -> tuple[list[int], tuple | None]:
+        """One page of users with open reports and the cursor for the next page (None at the end).
+
+        ``order`` is "count" (most reported first) or "recency" (newest open
+        report first).  ``min_count`` / ``since`` are prefixes of those
+        orders, so the first key that fails them ends the list.
+        """
+        if order == "count":
+            keys, more = self.by_count.page(after, n)
+            stop = next((i for i, k in enumerate(keys) if -k[0] < min_count), None)
+        else:
+            keys, more = self.by_recency.page(after, n)
+            cutoff = to_us(since) if since else None
+            stop = next((i for i, k in enumerate(keys) if cutoff and -k[0] < cutoff), None)
+        if stop is not None:
+            keys, more = keys[:stop], False
+        return [k[1] for k in keys], (keys[-1] if more else None)
+
+
+# ─────────────  Sharded deployment  ─────────────
+# Set by shard.py for each worker process.  Matchmaking then goes through the
+# coordinator; active_chats / blocked_users become replicas it keeps in sync.
+SHARD_SOCKET = os.getenv("SHARD_SOCKET")
+SHARD_ID     = int(os.getenv("SHARD_ID", "0"))
+SHARD_COUNT  = int(os.getenv("SHARD_COUNT", "1"))
+shard_client = ShardClient(SHARD_ID, SHARD_SOCKET) if SHARD_SOCKET else None
+
+def owns_user(uid: int) -> bool:
+    """True if this process is the one that talks to ``uid`` (always, unsharded)."""
+    return uid % SHARD_COUNT == SHARD_ID
+
 # In-memory data
-users = {}
-waiting_users = []
+waiting_users = ShardWaitSet(shard_client) if shard_client else MatchQueue()
+# who not to re-pair right away; /report reads the latest entry
+recent_partners = RecentPartners(int(os.getenv("RECENT_PARTNERS", "3")),
+                                 int(os.getenv("REMATCH_COOLDOWN_SEC", "600")))
 active_chats = {}
-report_history = []   # each dict: {"reporter":uid,"reported":uid,"reason":txt,"time":datetime, "handled":False}
+report_history = ReportStore()   # each report: {"reporter":uid,"reported":uid,"reason":txt,"time":datetime, "handled":False}
 admins = [7460406130]  # Replace with your Telegram user ID
 blocked_users = set()
-daily_matches = {}
 
 GENDER_EMOJI = {'Male': '🚹', 'Female': '🚺', 'Other': '⚧'}
 LANGUAGES = {
     'hi': '🇮🇳 Hindi', 'en': '🇺🇸 English', 'ja': '🇯🇵 Japanese', 'ko': '🇰🇷 Korean',
     'id': '🇮🇩 Indonesian', 'zh': '🇨🇳 Chinese', 'ru': '🇷🇺 Russian'
 }
+users = ProfileStore(GENDER_EMOJI, LANGUAGES)   # uid → compact profile (see profiles.py)
+
+# ─────────────  Prebuilt keyboards  ─────────────
+# Markups are immutable, so every handler shares one instance instead of
+# rebuilding the buttons on each update.
+CANCEL_SETTINGS_ROW = [InlineKeyboardButton("❌ Cancel", callback_data="cancel_settings")]
+
+GENDER_KB = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🚹 Male",   callback_data="set_gender:Male"),
+    InlineKeyboardButton("🚺 Female", callback_data="set_gender:Female"),
+    InlineKeyboardButton("⚧ Other",  callback_data="set_gender:Other"),
+]])
+LANGUAGE_KB = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(name, callback_data=f"set_lang:{code}")] for code, name in LANGUAGES.items()]
+)
+SETTINGS_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎂 Age", callback_data="set_age")],
+    [InlineKeyboardButton("🌐 Language", callback_data="change_language")],
+    CANCEL_SETTINGS_ROW,
+])
+AGE_KB = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(str(a), callback_data=f"age:{a}") for a in range(i, i + 5)] for i in range(10, 84, 5)]
+    + [CANCEL_SETTINGS_ROW]
+)
+SETTINGS_LANGUAGE_KB = InlineKeyboardMarkup([*LANGUAGE_KB.inline_keyboard, CANCEL_SETTINGS_ROW])
+REPORT_BUTTON_KB = InlineKeyboardMarkup([[InlineKeyboardButton("🚩 Report", callback_data="report:open")]])
+
+ASK_GENDER   = "👇 Please select your gender. ⚠️ Once set, cannot be changed."
+ASK_LANGUAGE = "👇 Please select your language:\n🔸 You can change this later using /settings"
 
 # Utils
 def get_profile(user_id):
-    u = users[user_id]
-    gender = f"{GENDER_EMOJI.get(u['gender'], '')} {u['gender']}"
-    language = LANGUAGES.get(u['language'], u['language'])
-    age = f"{u['age']}" if 'age' in u else "Not set"
+    g, lang, a = users.gender(user_id), users.language(user_id), users.age(user_id)
+    gender = f"{GENDER_EMOJI.get(g, '')} {g}"
+    language = LANGUAGES.get(lang, lang)
+    age = f"{a}" if a else "Not set"
     return f"👤 Your Profile:\n🔹Gender: {gender}\n🔹Language: {language}\n🔹Age: {age}"
 
 def is_profile_complete(user_id):
-    return 'gender' in users[user_id] and 'language' in users[user_id]
-
-def increase_match_count():
-    today = datetime.now().date().isoformat()
-    daily_matches[today] = daily_matches.get(today, 0) + 1
+    return users.is_complete(user_id)
+
+# ─────────────  Stats counters  ─────────────
+# Kept in step at mutation time so admin:stats never walks users/reports.
+# (open reports are counted by report_history itself)
+stats = {"users_total": 0, "profiles_done": 0, "new_day": None, "new_today": 0}
+
+def bump_new_today(day: str):
+    if stats["new_day"] != day:
+        stats["new_day"], stats["new_today"] = day, 0
+    stats["new_today"] += 1
+
+def new_users_today() -> int:
+    today = datetime.utcnow().date().isoformat()
+    return stats["new_today"] if stats["new_day"] == today else 0
+
+def recount_stats():
+    """Rebuild the counters from SQLite (startup only, after load_state has flushed)."""
+    today = datetime.utcnow().date().isoformat()
+    stats["users_total"] = store.count("users")
+    stats["profiles_done"] = store.count(
+        "users", "json_extract(v, '$.gender') IS NOT NULL AND json_extract(v, '$.language') IS NOT NULL")
+    stats["new_day"] = today
+    stats["new_today"] = store.count("users", "json_extract(v, '$.created') = ?", (today,))
+
+def remember_pair(a, b):
+    """Note a and b as each other's recent partner (for users this process serves)."""
+    if owns_user(a):
+        recent_partners.add(a, b)
+    if owns_user(b):
+        recent_partners.add(b, a)
+
+def pair_users(a, b):
+    active_chats[a] = b
+    active_chats[b] = a
+    store.put("active_chats", a, b)
+    store.put("active_chats", b, a)
+    remember_pair(a, b)
+    open_sessions(a, b)
+    track_chat(a, b)
+    journal.append("match", a, b)
+    MATCHES_TOTAL.inc()
+    TS_MATCHES.record()
+
+def unpair_user(user_id):
+    """End user_id's chat and return the partner."""
+    partner_id = active_chats.pop(user_id)
+    active_chats.pop(partner_id, None)
+    store.delete("active_chats", user_id)
+    store.delete("active_chats", partner_id)
+    journal.append("unmatch", user_id, partner_id)
+    close_sessions(user_id, partner_id)
+    untrack_chat(user_id, partner_id)
+    return partner_id
+
+# ─────────────  Persistence  ─────────────
+# SQLite (WAL) write-behind store; the dicts above remain the hot cache.
+# The journal + snapshot pair is what a restart actually loads from.
+store = StateStore(os.getenv("DB_PATH", "gabbar.db"), flush_ms=int(os.getenv("DB_FLUSH_MS", "200")))
+journal = Journal(os.getenv("JOURNAL_DIR", "journal"),
+                  flush_ms=int(os.getenv("JOURNAL_FLUSH_MS", "50")),
+                  snapshot_sec=int(os.getenv("SNAPSHOT_SEC", "300")))
+
+def save_user(user_id):
+    profile = users.as_dict(user_id)   # disk and journal keep the plain dict format
+    store.put("users", user_id, profile)
+    journal.append("profile", user_id, profile)
+
+def ensure_user(user_id):
+    """Make the user resident (loading or creating the profile), counting them on first sight."""
+    if not touch_user(user_id):
+        today = datetime.utcnow().date().isoformat()
+        users.add(user_id, today)
+        hot_users[user_id] = None
+        stats["users_total"] += 1
+        bump_new_today(today)
+        save_user(user_id)
+
+def set_profile_field(user_id, field, value):
+    ensure_user(user_id)
+    was_complete = is_profile_complete(user_id)
+    users.set(user_id, field, value)
+    if not was_complete and is_profile_complete(user_id):
+        stats["profiles_done"] += 1
+    save_user(user_id)
+
+def add_report(report: dict):
+    rid = report_history.add(report)
+    TS_REPORTS.record()
+    store.put("reports", rid, report)
+    journal.append("report", report)
+
+def save_block(uid: int):
+    """Persist blocked_users[uid] and mark the user's open reports handled."""
+    for rid in report_history.mark_handled(uid):
+        store.put("reports", rid, report_history.reports[rid])
+    store.put("blocked_users", uid, blocked_users[uid])
+    journal.append("block", uid, blocked_users[uid])
+    if shard_client:
+        shard_client.cast("block", uid=uid, info=blocked_users[uid])
+
+def drop_block(uid: int):
+    blocked_users.pop(uid, None)
+    ban_messages.pop(uid, None)
+    store.delete("blocked_users", uid)
+    journal.append("unblock", uid)
+    if shard_client:
+        shard_client.cast("unblock", uid=uid)
+
+def replay(op, *args):
+    """Re-apply one journal record to the in-memory state."""
+    if op == "profile":
+        uid, profile = args
+        users.load(uid, profile)
+    elif op == "match":
+        a, b = args[:2]          # older records also carry the day
+        active_chats[a] = b
+        active_chats[b] = a
+    elif op == "unmatch":
+        a, b = args
+        active_chats.pop(a, None)
+        active_chats.pop(b, None)
+    elif op == "report":
+        report_history.add(args[0])
+    elif op == "block":
+        uid, info = args
+        blocked_users[uid] = info
+        report_history.mark_handled(uid)
+    elif op == "unblock":
+        blocked_users.pop(args[0], None)
+
+def current_state():
+    """Copies of everything the snapshot holds; the journal pickles them off the loop.
+
+    Report dicts are never changed after they are added (mark_handled swaps
+    in a new dict), so a shallow copy of the list is enough.
+    """
+    return {"users": users.copy(), "active_chats": dict(active_chats), "reports": list(report_history.reports),
+            "blocked_users": dict(blocked_users), "rollups": copy.deepcopy(rollups)}
+
+def load_state():
+    """Fill the in-memory dicts from disk (call once before the bot starts).
+
+    Prefers the mmap'd snapshot plus journal tail; falls back to SQLite when
+    no snapshot exists yet.  A fresh snapshot is written right away so the
+    next restart starts from here.
+    """
+    store.open()
+    journal.open()
+    state, tail = journal.recover()
+    if state is None:
+        state = store.load(skip=("users",))    # profiles load lazily on each user's next update
+        state["reports"] = [state["reports"][i] for i in sorted(state["reports"])]
+
+    users.update(state["users"])
+    active_chats.update(state["active_chats"])
+    report_history.extend(state["reports"])
+    if "rollups" in state:
+        rollups.restore(state["rollups"])
+    blocked_users.update(state["blocked_users"])
+    for op, args in tail:
+        replay(op, *args)
+    for uid, info in blocked_users.items():
+        schedule_unblock(uid, info["until"])
+
+    # SQLite may lag the snapshot + journal; catch it up so lazy loads and the
+    # counters below see the same profiles as memory
+    hot_users.update(dict.fromkeys(users))
+    for uid in users:
+        store.put("users", uid, users.as_dict(uid))
+    store.flush()
+    recount_stats()
+
+    journal.write_snapshot(current_state())
+    logger.info("Loaded %d users (%d resident), %d chats, %d reports, %d bans (%d journal records replayed)",
+                stats["users_total"], len(users), len(active_chats) // 2, len(report_history),
+                len(blocked_users), len(tail))
+
+# ─────────────  Hot user set  ─────────────
+# Only recently seen users keep a profile slot (and PTB user/chat data) in
+# memory.  Everyone else lives in SQLite and is loaded back by touch_user on
+# their next update.  Users in a chat or in the search pool are never evicted,
+# and neither is anyone whose latest write hasn't reached SQLite yet.
+HOT_USERS = int(os.getenv("HOT_USERS", "100000"))
+EVICT_SEC = 10
+
+hot_users: OrderedDict[int, None] = OrderedDict()   # resident uids, least recently seen first
+
+def touch_user(uid) -> bool:
+    """Mark ``uid`` as just seen, loading an evicted profile; False if we have never seen them."""
+    if uid in users:
+        hot_users.move_to_end(uid)
+        return True
+    profile = store.get("users", uid)
+    if profile is None:
+        return False
+    users.load(uid, profile)
+    hot_users[uid] = None
+    USER_LOADS_TOTAL.inc()
+    return True
+
+def evict_cold_users(application) -> int:
+    """Trim the hot set back to HOT_USERS, least recently seen first."""
+    evicted = 0
+    for _ in range(len(hot_users) - HOT_USERS):
+        uid = next(iter(hot_users))
+        if uid in active_chats or uid in waiting_users or store.is_pending("users", uid):
+            hot_users.move_to_end(uid)      # pinned for now; look again next sweep
+            continue
+        del hot_users[uid]
+        users.remove(uid)
+        recent_partners.forget(uid)
+        unreachable_users.discard(uid)
+        application.drop_user_data(uid)
+        application.drop_chat_data(uid)    # private chat id == user id
+        evicted += 1
+    EVICTIONS_TOTAL.inc(evicted)
+    return evicted
+
+async def evict_loop(application):
+    while True:
+        await asyncio.sleep(EVICT_SEC)
+        evict_cold_users(application)
 
 # ── /start handler ────────────────────────────────────────────
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await update.message.reply_text(msg)
-        return
 
-    # ensure user dict exists
-    if user_id not in users:
-        users[user_id] = {}
-    u = users[user_id]
+    # ensure the user has a profile slot
+    ensure_user(user_id)
 
     # ── 1) PROFILE INCOMPLETE ────────────────────────────────
     if not is_profile_complete(user_id):
         await update.message.reply_text("🚫 Please complete your profile first.")
 
         # ask for gender if missing
-        if "gender" not in u:
-            buttons = [[
-                InlineKeyboardButton("🚹 Male",   callback_data="set_gender:Male"),
-                InlineKeyboardButton("🚺 Female", callback_data="set_gender:Female"),
-                InlineKeyboardButton("⚧ Other",  callback_data="set_gender:Other"),
-            ]]
-            await update.message.reply_text(
-                "👇 Please select your gender. ⚠️ Once set, cannot be changed.",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
+        if users.gender(user_id) is None:
+            await update.message.reply_text(ASK_GENDER, reply_markup=GENDER_KB)
             return GENDER
 
         # ask for language if gender present but language missing
-        if "language" not in u:
-            buttons = [[InlineKeyboardButton(name, callback_data=f"set_lang:{code}")]
-                       for code, name in LANGUAGES.items()]
+        if users.language(user_id) is None:
             context.chat_data["via_start"] = True
-            
-            await update.message.reply_text(
-                """👇 Please select your language:
-  🔸 You can change this later using /settings""",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
+            await update.message.reply_text(ASK_LANGUAGE, reply_markup=LANGUAGE_KB)
             return LANGUAGE
 
         # Nothing else to do
@@ -113,12 +1093,10 @@ async def set_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     user_id = query.from_user.id
     gender = query.data.split(':')[1]
-    users[user_id]['gender'] = gender
-    buttons = [[InlineKeyboardButton(name, callback_data=f'set_lang:{code}')]
-               for code, name in LANGUAGES.items()]
+    set_profile_field(user_id, 'gender', gender)
     await query.edit_message_text(
         "🌐 Please select your language:\n\n🔸 You can change this later using /settings",
-        reply_markup=InlineKeyboardMarkup(buttons))
+        reply_markup=LANGUAGE_KB)
     return LANGUAGE
 
 # 🔹 First-time language selection
@@ -127,7 +1105,7 @@ async def set_language_initial(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
     user_id = query.from_user.id
     lang = query.data.split(':')[1]
-    users[user_id]['language'] = lang
+    set_profile_field(user_id, 'language', lang)
     await query.edit_message_text(f"✅ Language set to: {LANGUAGES[lang]}\n\n✅ Your profile is complete.")
     await context.bot.send_message(user_id, "⏳ Waiting for a partner...\n💬 Use /stop to cancel or /next to retry.")
     await find_partner(user_id, context)
@@ -139,7 +1117,7 @@ async def set_language_change(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
     user_id = query.from_user.id
     lang = query.data.split(':')[1]
-    users[user_id]['language'] = lang
+    set_profile_field(user_id, 'language', lang)
 
     if user_id in active_chats:
         await query.edit_message_text(
@@ -159,14 +1137,8 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     user_id = query.from_user.id
 
-    # 🔒 Block check
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await query.message.reply_text(msg)
-        return
-
     lang = query.data.split(':')[1]
-    users[user_id]['language'] = lang
+    set_profile_field(user_id, 'language', lang)
 
     # क्या यह /start के दौरान आया था?
     if context.chat_data.get("via_start"):
@@ -194,91 +1166,304 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ─────────── Match-making helper ───────────
 async def find_partner(user_id, context):
-    if user_id in waiting_users:
-        return
-
-    for partner_id in waiting_users:
-        if partner_id != user_id and partner_id not in blocked_users:
-            waiting_users.remove(partner_id)
-            active_chats[user_id] = partner_id
-            active_chats[partner_id] = user_id
-            increase_match_count()
-
-            # 🔹 दोनों user की last_partner सेट करो (for /report)
-            context.user_data["last_partner"] = partner_id
-            if "last_partner" not in context.chat_data:
-                context.chat_data["last_partner"] = {}
-            context.chat_data["last_partner"][partner_id] = user_id
-
-            await context.bot.send_message(user_id, format_match_message(partner_id))
-            await context.bot.send_message(partner_id, format_match_message(user_id))
+    async with pair_locks(user_id):
+        if user_id in waiting_users:
             return
 
-    waiting_users.append(user_id)
+        language, gender = users.language(user_id), users.gender(user_id)
 
-def format_match_message(uid):
-    u = users[uid]
-    return ("✨ You've got a match! ✨\n\nPartner found:\n"
-            f"🔹Gender: {GENDER_EMOJI[u['gender']]} {u['gender']}\n"
-            f"🔹Language: {LANGUAGES[u['language']]}\n"
-            f"🔹Age: {u.get('age', 'Not set')}\n\n"
-            "🔸 /next — find a new partner\n🔸 /stop — stop this chat")
+        # Tick mode: just join the pool, match_tick_loop pairs everyone in one pass
+        if MATCH_TICK_MS and not shard_client:
+            if admission.pool_full(len(waiting_users)):
+                await send_pool_full(user_id, context)
+                return
+            waiting_users.add(user_id, language, gender)
+            return
 
-# ─────────────  /next  ──────────────
-async def next_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        partner_profile = None
+        if shard_client:
+            reply = await shard_client.call("find", uid=user_id, language=language, gender=gender,
+                                            profile=users.as_dict(user_id),
+                                            avoid=recent_partners.recent(user_id))
+            if reply.get("in_chat"):       # still paired on the coordinator: don't queue locally
+                await context.bot.send_message(
+                    user_id, "💬 You are already in a chat.\n💬 Use /stop to end or /next to skip.",
+                    rate_limit_args=LANE_MATCH)
+                return
+            partner_id, partner_profile = reply["partner"], reply.get("profile")
+            waited = reply.get("waited", 0.0)
+        else:
+            found = waiting_users.pop_partner(language, skip=lambda uid: uid in blocked_users,
+                                              avoid=lambda uid: recent_partners.seen(user_id, uid))
+            partner_id, waited = found or (None, 0.0)
+        if partner_id is None:
+            # in shard mode the coordinator already queued us
+            if not shard_client and admission.pool_full(len(waiting_users)):
+                await send_pool_full(user_id, context)
+                return
+            waiting_users.add(user_id, language, gender)
+            return
+
+        # partner came straight off the queue, so nobody else can be holding its lock for long
+        async with pair_locks(partner_id):
+            pair_users(user_id, partner_id)
+            TS_WAIT_SEC.record(waited)        # the partner's time in the pool
+            TS_WAIT_SEC.record(0.0)           # we matched on arrival
+
+            for res in await asyncio.gather(
+                    context.bot.send_message(user_id, format_match_message(partner_id, partner_profile),
+                                             rate_limit_args=LANE_MATCH),
+                    context.bot.send_message(partner_id, format_match_message(user_id), rate_limit_args=LANE_MATCH),
+                    return_exceptions=True):
+                if isinstance(res, Exception) and not is_unreachable_error(res):
+                    logger.warning("Match notification failed: %s", res)
+
+async def send_pool_full(user_id, context):
+    await context.bot.send_message(
+        user_id, "🚦 Too many people are searching right now.\n💬 Please try /next again in a minute.",
+        rate_limit_args=LANE_MATCH)
+
+async def leave_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, partner_text: str, own_text: str) -> bool:
+    """End the caller's chat (if any) and notify both sides; False if not in a chat.
+
+    Runs under the pair lock so the partner can't be re-matched, or told about
+    a new match, before the "partner left" notice has gone out.
+    """
     user_id = update.effective_user.id
+    partner_id = active_chats.get(user_id)
+    if partner_id is None:
+        return False
 
-    # 🔒 Block-guard
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await update.message.reply_text(msg)
-        return
+    async with pair_locks(user_id, partner_id):
+        if active_chats.get(user_id) != partner_id:
+            return False          # the partner ended it while we waited
+        unpair_user(user_id)
+        if shard_client:
+            shard_client.cast("unpair", uid=user_id)
 
-    if user_id not in users:
-        users[user_id] = {}
-    u = users[user_id]
+        try:
+            await context.bot.send_message(partner_id, partner_text, reply_markup=REPORT_BUTTON_KB,
+                                           rate_limit_args=LANE_MATCH)
+        except TelegramError as exc:
+            if not is_unreachable_error(exc):
+                raise
+        await update.message.reply_text(own_text, reply_markup=REPORT_BUTTON_KB)
+    return True
+
+def format_match_message(uid, profile=None):
+    """``profile`` is the partner's dict when the coordinator handed it over from another shard."""
+    if profile:
+        gender, language, age = profile['gender'], profile['language'], profile.get('age')
+    else:
+        touch_user(uid)     # the partner may have been idle long enough to be evicted
+        gender, language, age = users.gender(uid), users.language(uid), users.age(uid)
+    return ("✨ You've got a match! ✨\n\nPartner found:\n"
+            f"🔹Gender: {GENDER_EMOJI[gender]} {gender}\n"
+            f"🔹Language: {LANGUAGES[language]}\n"
+            f"🔹Age: {age or 'Not set'}\n\n"
+            "🔸 /next — find a new partner\n🔸 /stop — stop this chat")
 
-    if not is_profile_complete(user_id):
-        await update.message.reply_text("🚫 Please complete your profile first.")
-        if "gender" not in u:
-            buttons = [[
-                InlineKeyboardButton("🚹 Male",   callback_data="set_gender:Male"),
-                InlineKeyboardButton("🚺 Female", callback_data="set_gender:Female"),
-                InlineKeyboardButton("⚧ Other",  callback_data="set_gender:Other"),
-            ]]
-            await update.message.reply_text("👇 Please select your gender. ⚠️ Once set, cannot be changed.",
-                                            reply_markup=InlineKeyboardMarkup(buttons))
-            return
-        if "language" not in u:
-            buttons = [[InlineKeyboardButton(txt, callback_data=f'set_lang:{code}')]
-                       for code, txt in LANGUAGES.items()]
-            await update.message.reply_text(
-                "👇 Please select your language:\n🔸 You can change this later using /settings",
-                reply_markup=InlineKeyboardMarkup(buttons))
+# ─────────────  Batch matching tick  ─────────────
+# MATCH_TICK_MS > 0 switches find_partner to "enqueue only" and pairs the whole
+# wait-pool every tick; 0 keeps the greedy per-request path.
+MATCH_TICK_MS     = int(os.getenv("MATCH_TICK_MS", "0"))
+AGE_NEIGHBOURS    = 4     # age-sorted neighbours looked at on each side
+AGE_UNKNOWN_GAP   = 5     # age distance assumed when one side has no age
+AGING_STEP_SEC    = 10    # every 10s waited forgives 1 year of age gap
+CROSS_LANG_AFTER  = 30    # seconds before a user may be paired across languages
+
+def plan_matches(entries, now, avoid=None):
+    """Global pairing pass over ``(uid, language, age, enqueued_at)`` entries.
+
+    Within a language, users sit in age order and each one – oldest waiter
+    first – takes the closest-aged free neighbour, where the neighbour's wait
+    time shaves years off the gap.  Whoever is left after waiting
+    CROSS_LANG_AFTER seconds is paired across languages in FIFO order.
+    Pairs for which ``avoid(a, b)`` is true (recent partners) are never made.
+    """
+    by_lang = {}
+    for e in entries:
+        by_lang.setdefault(e[1], []).append(e)
+
+    paired, pairs = set(), []
+    for group in by_lang.values():
+        group.sort(key=lambda e: (e[2] is None, e[2] or 0))
+        pos = {e[0]: i for i, e in enumerate(group)}
+        for e in sorted(group, key=lambda e: e[3]):
+            if e[0] in paired:
+                continue
+            i, best, best_score = pos[e[0]], None, None
+            for step in (-1, 1):
+                j, seen = i + step, 0
+                while 0 <= j < len(group) and seen < AGE_NEIGHBOURS:
+                    c = group[j]
+                    j += step
+                    if c[0] in paired or (avoid and avoid(e[0], c[0])):
+                        continue
+                    seen += 1
+                    gap = AGE_UNKNOWN_GAP if e[2] is None or c[2] is None else abs(e[2] - c[2])
+                    score = gap - (now - c[3]) / AGING_STEP_SEC
+                    if best_score is None or score < best_score:
+                        best, best_score = c, score
+            if best is not None:
+                paired.update((e[0], best[0]))
+                pairs.append((e[0], best[0]))
+
+    leftovers = sorted((e for e in entries if e[0] not in paired and now - e[3] >= CROSS_LANG_AFTER),
+                       key=lambda e: e[3], reverse=True)
+    free = [e[0] for e in leftovers]     # oldest waiter last, so pop() is FIFO
+    while len(free) > 1:
+        a = free.pop()
+        for k in range(len(free) - 1, -1, -1):
+            if not (avoid and avoid(a, free[k])):
+                pairs.append((a, free.pop(k)))
+                break
+    return pairs
+
+async def run_match_tick(application):
+    """One tick: plan pairs for the whole pool, then notify every pair at once."""
+    now = time.monotonic()
+    entries = []
+    for uid, language, since in waiting_users.entries():
+        if uid in blocked_users:
+            continue
+        entries.append((uid, language, users.age(uid), since))
+    for uid in [uid for uid in waiting_users if uid in blocked_users]:
+        waiting_users.remove(uid)
+
+    pairs = plan_matches(entries, now, avoid=recent_partners.seen)
+    enqueued = {e[0]: e[3] for e in entries} if pairs else {}
+    sends = []
+    for a, b in pairs:
+        waiting_users.remove(a)
+        waiting_users.remove(b)
+        pair_users(a, b)
+        TS_WAIT_SEC.record(now - enqueued[a])
+        TS_WAIT_SEC.record(now - enqueued[b])
+        sends.append(application.bot.send_message(a, format_match_message(b), rate_limit_args=LANE_MATCH))
+        sends.append(application.bot.send_message(b, format_match_message(a), rate_limit_args=LANE_MATCH))
+
+    for res in await asyncio.gather(*sends, return_exceptions=True):
+        if isinstance(res, Exception):
+            logger.warning("Match notification failed: %s", res)
+    return len(pairs)
+
+async def match_tick_loop(application):
+    while True:
+        try:
+            await run_match_tick(application)
+        except Exception:
+            logger.exception("Match tick failed")
+        await asyncio.sleep(MATCH_TICK_MS / 1000)
+
+# ─────────────  Idle chat reaper  ─────────────
+# Chats with no relayed message for CHAT_IDLE_SEC are ended for both sides.
+# message_handler only stamps chat_last_active (O(1)); each chat has one
+# timer in idle_wheel, and when it fires the reaper either ends the chat or
+# re-arms it for last activity + CHAT_IDLE_SEC.  So an active chat costs one
+# wheel operation per idle period, not per message, and nothing is scanned.
+# Off in shard mode: each worker only sees its own users' messages.
+CHAT_IDLE_SEC  = int(os.getenv("CHAT_IDLE_SEC", "900"))      # 0 disables the reaper
+REAP_TICK_SEC  = 5
+REAP_IDLE      = CHAT_IDLE_SEC > 0 and not shard_client
+
+chat_last_active: dict[int, float] = {}    # lower uid of the pair → monotonic time of the last message
+idle_wheel = TimerWheel(REAP_TICK_SEC, slots=max(1, CHAT_IDLE_SEC // REAP_TICK_SEC) + 1, now=time.monotonic())
+
+def track_chat(a, b, now=None):
+    if REAP_IDLE:
+        key, now = min(a, b), time.monotonic() if now is None else now
+        chat_last_active[key] = now
+        idle_wheel.schedule(key, now + CHAT_IDLE_SEC)
+
+def untrack_chat(a, b):
+    key = min(a, b)
+    if chat_last_active.pop(key, None) is not None:
+        idle_wheel.cancel(key)
+
+def touch_chat(a, b):
+    key = min(a, b)
+    if key in chat_last_active:
+        chat_last_active[key] = time.monotonic()
+
+async def end_idle_chat(bot, a, b):
+    """The normal "partner left" flow, run for both sides at once."""
+    async with pair_locks(a, b):
+        if active_chats.get(a) != b:
+            return            # someone left or re-matched meanwhile
+        last = chat_last_active.get(min(a, b), 0.0)
+        if time.monotonic() - last < CHAT_IDLE_SEC:
+            idle_wheel.schedule(min(a, b), last + CHAT_IDLE_SEC)    # a message got in first
             return
+        unpair_user(a)
+        IDLE_ENDED_TOTAL.inc()
+        text = (f"⌛ Your chat ended after {CHAT_IDLE_SEC // 60} minutes without messages.\n"
+                "💬 Use /next to find someone new.")
+        for res in await asyncio.gather(
+                *(bot.send_message(uid, text, reply_markup=REPORT_BUTTON_KB, rate_limit_args=LANE_MATCH)
+                  for uid in (a, b)),
+                return_exceptions=True):
+            if isinstance(res, Exception):
+                logger.warning("Idle-chat notice failed: %s", res)
+
+async def idle_reaper_loop(bot):
+    now = time.monotonic()
+    for a, b in list(active_chats.items()):
+        if a < b and a not in chat_last_active:
+            track_chat(a, b, now)      # restored chats get a full period from startup
+    while True:
+        await asyncio.sleep(REAP_TICK_SEC)
+        now = time.monotonic()
+        for key in idle_wheel.advance(now):
+            partner, last = active_chats.get(key), chat_last_active.get(key)
+            if partner is None or last is None:
+                chat_last_active.pop(key, None)
+            elif now - last < CHAT_IDLE_SEC:
+                idle_wheel.schedule(key, last + CHAT_IDLE_SEC)
+            else:
+                spawn(end_idle_chat(bot, key, partner))
+
+# ─────────────  Unreachable users  ─────────────
+# A user who blocked the bot (or deleted the account) makes every send fail
+# with Forbidden.  LaneRateLimiter notices the first such reply and adds the
+# user to unreachable_users, after which sends to them fail at once without
+# an API call.  mark_unreachable takes them out of the pool straight away and
+# ends their chat, telling the partner as if they had left.  Any update from
+# the user clears the entry (admission_gate), and so does eviction.
+unreachable_users: set[int] = set()
+
+def mark_unreachable(bot, uid):
+    """LaneRateLimiter hook: a send to ``uid`` found them unreachable."""
+    logger.info("User %s is unreachable, dropping them from the pool and chats", uid)
+    if not owns_user(uid):
+        unreachable_users.discard(uid)    # only the owning worker sees their next update
+    waiting_users.remove(uid)
+    if uid in active_chats:
+        spawn(end_dead_chat(bot, uid))
+
+async def end_dead_chat(bot, uid):
+    partner_id = active_chats.get(uid)
+    if partner_id is None:
         return
+    async with pair_locks(uid, partner_id):
+        if active_chats.get(uid) != partner_id:
+            return            # already ended
+        unpair_user(uid)
+        if shard_client:
+            shard_client.cast("unpair", uid=uid)
+        try:
+            await bot.send_message(partner_id, "❌ Your partner left the chat.\n💬 Use /next to find someone new.",
+                                   reply_markup=REPORT_BUTTON_KB, rate_limit_args=LANE_MATCH)
+        except TelegramError as exc:
+            logger.warning("Partner-left notice to %s failed: %s", partner_id, exc)
 
-    if user_id in active_chats:
-        partner_id = active_chats.pop(user_id)
-        active_chats.pop(partner_id, None)
-
-        # Save last partner for both users
-        context.user_data["last_partner"] = partner_id
-        if "last_partner" not in context.chat_data:
-            context.chat_data["last_partner"] = {}
-        context.chat_data["last_partner"][partner_id] = user_id
+# ─────────────  /next  ──────────────
+async def next_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
 
-        btn = InlineKeyboardMarkup([[InlineKeyboardButton("🚩 Report", callback_data="report:open")]])
-        await context.bot.send_message(
-            partner_id,
-            "❌ Your partner left the chat.\n💬 Use /next to find someone new.",
-            reply_markup=btn
-        )
-        await update.message.reply_text(
-            "✅ You left the chat.\n⏳ Searching for a new partner …",
-            reply_markup=btn
-        )
-    else:
+    if not await leave_chat(update, context,
+                            "❌ Your partner left the chat.\n💬 Use /next to find someone new.",
+                            "✅ You left the chat.\n⏳ Searching for a new partner …"):
         await update.message.reply_text("⏳ Waiting for a partner...\n💬 Use /stop to cancel.")
 
     await find_partner(user_id, context)
@@ -286,97 +1471,20 @@ async def next_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ─────────────  /stop  ──────────────
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    
-    # 🔒 Block-guard
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await update.message.reply_text(msg)
-        return
-
-    if user_id not in users:
-        users[user_id] = {}
-    u = users[user_id]
 
-    if not is_profile_complete(user_id):
-        await update.message.reply_text("🚫 Please complete your profile first.")
-        if "gender" not in u:
-            buttons = [[
-                InlineKeyboardButton("🚹 Male", callback_data="set_gender:Male"),
-                InlineKeyboardButton("🚺 Female", callback_data="set_gender:Female"),
-                InlineKeyboardButton("⚧ Other", callback_data="set_gender:Other"),
-            ]]
-            await update.message.reply_text(
-                "👇 Please select your gender. ⚠️ Once set, cannot be changed.",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-            return
-        if "language" not in u:
-            buttons = [[InlineKeyboardButton(txt, callback_data=f'set_lang:{code}')] for code, txt in LANGUAGES.items()]
-            await update.message.reply_text(
-                "👇 Please select your language:\n🔸 You can change this later using /settings",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-            return
+    if await leave_chat(update, context,
+                        "❌ Your partner ended the chat.\n💬 Use /next to find someone new.",
+                        "✅ Chat stopped.\n💬 Use /next to chat again."):
         return
 
-    if user_id in active_chats:
-        partner_id = active_chats.pop(user_id)
-        active_chats.pop(partner_id, None)
-
-        # Save last partner for both users
-        context.user_data["last_partner"] = partner_id
-        if "last_partner" not in context.chat_data:
-            context.chat_data["last_partner"] = {}
-        context.chat_data["last_partner"][partner_id] = user_id
-
-        btn = InlineKeyboardMarkup([[InlineKeyboardButton("🚩 Report", callback_data="report:open")]])
-        await context.bot.send_message(
-            partner_id,
-            "❌ Your partner ended the chat.\n💬 Use /next to find someone new.",
-            reply_markup=btn
-        )
-        await update.message.reply_text(
-            "✅ Chat stopped.\n💬 Use /next to chat again.",
-            reply_markup=btn
-        )
+    if waiting_users.remove(user_id):
+        await update.message.reply_text("🛑 Search stopped.\n💬 Use /next to chat again.")
     else:
         await update.message.reply_text("❌ You are not in a chat.\n💬 Use /next to start chatting.")
 
 # ─────────────  /me  ──────────────
 async def me(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    
-    # 🔒 Block-guard
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await update.message.reply_text(msg)
-        return
-
-    if user_id not in users:
-        users[user_id] = {}
-    u = users[user_id]
-
-    if not is_profile_complete(user_id):
-        await update.message.reply_text("🚫 Please complete your profile first.")
-        if "gender" not in u:
-            buttons = [[
-                InlineKeyboardButton("🚹 Male", callback_data="set_gender:Male"),
-                InlineKeyboardButton("🚺 Female", callback_data="set_gender:Female"),
-                InlineKeyboardButton("⚧ Other", callback_data="set_gender:Other"),
-            ]]
-            await update.message.reply_text(
-                "👇 Please select your gender. ⚠️ Once set, cannot be changed.",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-            return
-        if "language" not in u:
-            buttons = [[InlineKeyboardButton(txt, callback_data=f'set_lang:{code}')] for code, txt in LANGUAGES.items()]
-            await update.message.reply_text(
-                "👇 Please select your language:\n🔸 You can change this later using /settings",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-            return
-        return
 
     profile_text = get_profile(user_id)
     if user_id in active_chats:
@@ -392,87 +1500,23 @@ async def me(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ─────────────  /settings  ──────────────
 async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """/settings command – shows Age / Language menu only if profile complete."""
-    user_id = update.effective_user.id
-
-    # 🔒 Block-guard 
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await update.message.reply_text(msg)
-        return
-
-    # make sure user-dict exists
-    if user_id not in users:
-        users[user_id] = {}
-    u = users[user_id]
-
-    # ── profile-completion guard ──
-    if not is_profile_complete(user_id):
-        await update.message.reply_text("🚫 Please complete your profile first.")
-
-        # ask gender if missing
-        if "gender" not in u:
-            buttons = [[
-                InlineKeyboardButton("🚹 Male",   callback_data="set_gender:Male"),
-                InlineKeyboardButton("🚺 Female", callback_data="set_gender:Female"),
-                InlineKeyboardButton("⚧ Other",  callback_data="set_gender:Other"),
-            ]]
-            await update.message.reply_text(
-                "👇 Please select your gender. ⚠️ Once set, cannot be changed.",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-            return
-
-        # ask language if missing
-        if "language" not in u:
-            buttons = [[InlineKeyboardButton(txt, callback_data=f"set_lang:{code}")]
-                       for code, txt in LANGUAGES.items()]
-            await update.message.reply_text(
-                "👇 Please select your language:\n🔸 You can change this later using /settings",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-            return
-        return  # should never reach here, but safety
-
-    # ── profile complete → show settings menu ──
-    menu_btns = [
-    [InlineKeyboardButton("🎂 Age", callback_data="set_age")],
-    [InlineKeyboardButton("🌐 Language", callback_data="change_language")],
-    [InlineKeyboardButton("❌ Cancel", callback_data="cancel_settings")]
-]
-    await update.message.reply_text("⚙️ Settings:", reply_markup=InlineKeyboardMarkup(menu_btns))
+    """/settings command – shows the Age / Language menu (onboarding_gate has checked the profile)."""
+    await update.message.reply_text("⚙️ Settings:", reply_markup=SETTINGS_KB)
 
 
 # ───────────  settings-callback (Age / Language lists) ───────────
 async def setting_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    user_id = query.from_user.id
-
-    # 🔒 Block-guard (✅ only blocks users if needed)
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await query.answer()
-        await query.message.reply_text(msg)
-        return
-
-    await query.answer()  # ✅ spinner close for normal users
+    await query.answer()
 
     # 👇 Age selection
     if query.data == "set_age":
-        age_buttons = [
-            [InlineKeyboardButton(str(a), callback_data=f"age:{a}") for a in range(i, i + 5)]
-            for i in range(10, 84, 5)
-        ]
-        age_buttons.append([InlineKeyboardButton("❌ Cancel", callback_data="cancel_settings")])
-        await query.edit_message_text("🎂 Select your age:", reply_markup=InlineKeyboardMarkup(age_buttons))
+        await query.edit_message_text("🎂 Select your age:", reply_markup=AGE_KB)
         return AGE
 
     # 👇 Language selection
     if query.data == "change_language":
-        lang_buttons = [[InlineKeyboardButton(txt, callback_data=f"set_lang:{code}")]
-                        for code, txt in LANGUAGES.items()]
-        lang_buttons.append([InlineKeyboardButton("❌ Cancel", callback_data="cancel_settings")])
-        await query.edit_message_text("🌐 Select your language:", reply_markup=InlineKeyboardMarkup(lang_buttons))
+        await query.edit_message_text("🌐 Select your language:", reply_markup=SETTINGS_LANGUAGE_KB)
         return TYPING_LANGUAGE
 
 
@@ -481,16 +1525,10 @@ async def set_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
 
-    # 🔒 Block-guard 
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await query.message.reply_text(msg)
-        return
-
     await query.answer()
 
     age = int(query.data.split(":")[1])
-    users[user_id]["age"] = age
+    set_profile_field(user_id, "age", age)
     await query.edit_message_text(f"🎂 Age updated to: {age}")
 
 
@@ -509,12 +1547,6 @@ async def cancel_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
 
-    # 🔒 Block-guard (✅ corrected)
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await query.message.reply_text(msg)
-        return
-
     await query.answer()
 
     if user_id in active_chats:
@@ -526,79 +1558,88 @@ async def cancel_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
-# ─────────────── Message Handler ──────────────
-async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-
-    # Block check
-    is_blk, msg = is_currently_blocked(user_id)
-    if is_blk:
-        await update.message.reply_text(msg)
+# ─────────────── Relay engine ──────────────
+# Everything is relayed with copy_message (one call path for every type,
+# including video notes, locations, polls and contacts).  Album parts are
+# held for ALBUM_WINDOW_SEC and forwarded as one send_media_group; anything
+# else the sender relays meanwhile flushes the album first, so the partner
+# sees messages in the order they were sent.
+ALBUM_WINDOW_SEC = 0.6
+ALBUM_MAX_ITEMS  = 10          # Telegram's media-group limit
+
+pending_albums: dict[str, dict] = {}   # media_group_id -> {"partner": uid, "chat": chat id, "msgs": [Message]}
+album_of_chat: dict[int, str] = {}     # sender's chat -> its pending media_group_id
+
+def album_item(msg):
+    caption = {"caption": msg.caption, "caption_entities": msg.caption_entities}
+    if msg.photo:
+        return InputMediaPhoto(msg.photo[-1].file_id, **caption)
+    if msg.video:
+        return InputMediaVideo(msg.video.file_id, **caption)
+    if msg.audio:
+        return InputMediaAudio(msg.audio.file_id, **caption)
+    if msg.document:
+        return InputMediaDocument(msg.document.file_id, **caption)
+    return None
+
+async def flush_album(group_id, bot):
+    await asyncio.sleep(ALBUM_WINDOW_SEC)
+    await send_album(group_id, bot)
+
+async def send_album(group_id, bot):
+    """Relay a pending album now (no-op if it already went out)."""
+    album = pending_albums.pop(group_id, None)
+    if not album:
+        return
+    if album_of_chat.get(album["chat"]) == group_id:
+        del album_of_chat[album["chat"]]
+    msgs = sorted(album["msgs"], key=lambda m: m.message_id)
+    media = [item for item in map(album_item, msgs) if item is not None]
+    try:
+        for i in range(0, len(media), ALBUM_MAX_ITEMS):
+            await bot.send_media_group(album["partner"], media[i:i + ALBUM_MAX_ITEMS],
+                                       rate_limit_args=LANE_RELAY)
+            RELAYS_TOTAL.inc()
+    except Exception as exc:
+        if not is_unreachable_error(exc):      # unreachable partners: end_dead_chat tells the sender
+            logger.exception("Album relay to %s failed", album["partner"])
+
+async def relay_message(msg, partner_id, bot):
+    session = chat_sessions.get(msg.chat_id)
+    if session is not None:
+        session[1] += 1
+    pending = album_of_chat.get(msg.chat_id)
+    if pending is not None and pending != msg.media_group_id:
+        await send_album(pending, bot)        # keep order: the earlier album goes out first
+    if msg.media_group_id:
+        album = pending_albums.get(msg.media_group_id)
+        if album is None:
+            pending_albums[msg.media_group_id] = {"partner": partner_id, "chat": msg.chat_id, "msgs": [msg]}
+            album_of_chat[msg.chat_id] = msg.media_group_id
+            spawn(flush_album(msg.media_group_id, bot))
+        else:
+            album["msgs"].append(msg)
         return
 
-    # Ensure user dict
-    if user_id not in users:
-        users[user_id] = {}
-    u = users[user_id]
+    try:
+        await bot.copy_message(partner_id, msg.chat_id, msg.message_id, rate_limit_args=LANE_RELAY)
+    except TelegramError as exc:
+        if is_unreachable_error(exc):
+            return            # end_dead_chat tells the sender
+        raise
+    RELAYS_TOTAL.inc()
 
-    # 🚫 Profile Incomplete
-    if not is_profile_complete(user_id):
-            await update.message.reply_text("🚫 Please complete your profile first.")
-            if "gender" not in u:
-                buttons = [[
-                    InlineKeyboardButton("🚹 Male",   callback_data="set_gender:Male"),
-                    InlineKeyboardButton("🚺 Female", callback_data="set_gender:Female"),
-                    InlineKeyboardButton("⚧ Other",  callback_data="set_gender:Other"),
-                ]]
-                await update.message.reply_text("👇 Please select your gender. ⚠️ Once set, cannot be changed.",
-                                                reply_markup=InlineKeyboardMarkup(buttons))
-                return
-            if "language" not in u:
-                buttons = [[InlineKeyboardButton(txt, callback_data=f'set_lang:{code}')]
-                           for code, txt in LANGUAGES.items()]
-                await update.message.reply_text(
-                    "👇 Please select your language:\n🔸 You can change this later using /settings",
-                    reply_markup=InlineKeyboardMarkup(buttons))
-                return
-            return
+
+# ─────────────── Message Handler ──────────────
+async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
 
     # ✅ If in chat
     if user_id in active_chats:
         partner_id = active_chats[user_id]
+        touch_chat(user_id, partner_id)
 
-        msg = update.message
-
-        # Text
-        if msg.text:
-            await context.bot.send_message(partner_id, msg.text)
-
-        # Photo
-        elif msg.photo:
-            await context.bot.send_photo(partner_id, photo=msg.photo[-1].file_id, caption=msg.caption)
-
-        # Sticker
-        elif msg.sticker:
-            await context.bot.send_sticker(partner_id, sticker=msg.sticker.file_id)
-
-        # Voice
-        elif msg.voice:
-            await context.bot.send_voice(partner_id, voice=msg.voice.file_id)
-
-        # Video
-        elif msg.video:
-            await context.bot.send_video(partner_id, video=msg.video.file_id, caption=msg.caption)
-
-        # GIF (animation)
-        elif msg.animation:
-            await context.bot.send_animation(partner_id, animation=msg.animation.file_id, caption=msg.caption)
-
-        # Audio
-        elif msg.audio:
-            await context.bot.send_audio(partner_id, audio=msg.audio.file_id, caption=msg.caption)
-
-        # Document
-        elif msg.document:
-            await context.bot.send_document(partner_id, document=msg.document.file_id, caption=msg.caption)
+        await relay_message(update.message, partner_id, context.bot)
 
     # ✅ Profile complete but NOT in chat
     elif user_id in waiting_users:
@@ -620,66 +1661,122 @@ REPORT_REASONS = {
     "Violence":    "⚔️ Violence",
     "Vulgar":      "🤬 Vulgar Partner"
 }
+REPORT_REASON_KB = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(txt, callback_data=f"rep_reason:{key}")] for key, txt in REPORT_REASONS.items()]
+    + [[InlineKeyboardButton("❌ Cancel", callback_data="rep_cancel")]]
+)
+
+# ─────────────  Admin notifications  ─────────────
+# Reports are handed to admin_notifier and the reporter's callback returns
+# at once.  The first report after a quiet spell goes out immediately; any
+# that arrive within the next ADMIN_DIGEST_SEC are merged into one digest.
+# Every admin is messaged concurrently.
+ADMIN_DIGEST_SEC  = 60
+DIGEST_TOP        = 5          # offenders / reasons listed in a digest
+
+class AdminNotifier:
+    def __init__(self, window: float = ADMIN_DIGEST_SEC):
+        self.window = window
+        self._pending: list[dict] = []
+        self._wakeup = asyncio.Event()
+
+    def report(self, report: dict):
+        self._pending.append(report)
+        self._wakeup.set()
+
+    def format(self, batch: list[dict]) -> str:
+        if len(batch) == 1:
+            r = batch[0]
+            return f"🚨 Report Received\nReporter: {r['reporter']}\nAgainst: {r['reported']}\nReason: {r['reason']}"
+        offenders = Counter(r["reported"] for r in batch).most_common(DIGEST_TOP)
+        reasons   = Counter(r["reason"] for r in batch).most_common(DIGEST_TOP)
+        return (
+            f"🚨 {len(batch)} new reports in the last {self.window:g}s\n"
+            "Top offenders: " + ", ".join(f"{uid} ({n})" for uid, n in offenders) + "\n"
+            "Reasons: " + ", ".join(f"{reason} ({n})" for reason, n in reasons) + "\n"
+            "🛡 Open /admin → Reports for details."
+        )
+
+    async def send(self, bot, text: str):
+        results = await asyncio.gather(
+            *(bot.send_message(admin_id, text, rate_limit_args=LANE_ADMIN) for admin_id in admins),
+            return_exceptions=True,
+        )
+        for admin_id, res in zip(admins, results):
+            if isinstance(res, Exception):
+                logger.warning("Admin notification to %s failed: %s", admin_id, res)
+
+    async def run(self, bot):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            await self.send(bot, self.format(batch))
+            await asyncio.sleep(self.window)     # reports arriving now wait for the digest
+
+admin_notifier = AdminNotifier()
 
 # 🔸 “🚩 Report” बटन ⇢ यह मेनू खोलता है
 async def open_report_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     user_id = query.from_user.id
 
-    # stop/next पर स्टोर किया गया पिछला partner
-    partner_id = context.user_data.get("last_partner")
-    if not partner_id:
+    # सबसे हाल का partner (recent_partners ring से)
+    partner_id = recent_partners.last(user_id)
+    if partner_id is None:
         await query.answer("There is no partner to report.", show_alert=True)
         return
-
-    buttons = [
-        [InlineKeyboardButton(txt, callback_data=f"rep_reason:{key}")]
-        for key, txt in REPORT_REASONS.items()
-    ]
-    buttons.append([InlineKeyboardButton("❌ Cancel", callback_data="rep_cancel")])
+    if report_history.has_open(user_id, partner_id):
+        await query.answer("You have already reported this partner.", show_alert=True)
+        return
+    await query.answer()
 
     await query.edit_message_text(
         "⚠️ Select a reason to report your previous partner:",
-        reply_markup=InlineKeyboardMarkup(buttons)
+        reply_markup=REPORT_REASON_KB
     )
 
 # 🔸 reason या “Cancel” क्लिक होने पर
 async def handle_report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     user_id = query.from_user.id
 
     # Cancel → मेसेज हटा कर लौटो
     if query.data == "rep_cancel":
+        await query.answer()
         await query.edit_message_text("❌ Report cancelled.\n💬 Use /next to start chatting.")
         return
 
     reason_key = query.data.split(":")[1]
     reason_txt = REPORT_REASONS[reason_key]
 
-    partner_id = context.user_data.pop("last_partner", None)
+    # the ring is memory-only, so after a restart or eviction it may be empty
+    partner_id = recent_partners.last(user_id)
+    if partner_id is None:
+        await query.answer("There is no partner to report.", show_alert=True)
+        return
+    if report_history.has_open(user_id, partner_id):
+        await query.answer("You have already reported this partner.", show_alert=True)
+        return
+    await query.answer()
 
     # Reporter को confirmation
     await query.edit_message_text(
         "✅ Report submitted. Thank you!\n💬 Use /next to start chatting."
     )
 
-    # Admins को सूचना
-    for admin in admins:
-        await context.bot.send_message(
-            admin,
-            f"🚨 Report Received\nReporter: {user_id}\nAgainst: {partner_id}\nReason: {reason_txt}"
-        )
-
     # History में दर्ज
-    report_history.append({
+    report = {
         "reporter": user_id,
         "reported": partner_id,
         "reason": reason_txt,
         "time": datetime.utcnow(),
         "handled": False
-    })
+    }
+    add_report(report)
+
+    # Admins को सूचना (background, merged into digests during bursts)
+    admin_notifier.report(report)
 # ──────────────────────────────────────────────────
 
 # ────────────────────────────────────────────────
@@ -687,8 +1784,41 @@ async def handle_report_reason(update: Update, context: ContextTypes.DEFAULT_TYP
 # ────────────────────────────────────────────────
 from datetime import datetime, timedelta
 
+class BanTable(dict):
+    """``{uid: info}`` that keeps ``by_expiry`` – ``(until, uid)`` keys – in step with every write."""
+
+    def __init__(self):
+        super().__init__()
+        self.by_expiry = SortedIndex()
+
+    def __setitem__(self, uid, info):
+        old = self.get(uid)
+        if old is not None:
+            self.by_expiry.discard((old["until"], uid))
+        super().__setitem__(uid, info)
+        self.by_expiry.add((info["until"], uid))
+
+    def pop(self, uid, *default):
+        if uid in self:
+            self.by_expiry.discard((self[uid]["until"], uid))
+        return super().pop(uid, *default)
+
+    def __delitem__(self, uid):
+        self.pop(uid)
+
+    def clear(self):
+        super().clear()
+        self.by_expiry = SortedIndex()
+
+    def update(self, other=(), **kwargs):
+        for uid, info in dict(other, **kwargs).items():
+            self[uid] = info
+
 # per-user block-info:  {uid: {"until": datetime , "count": n , "reason": str}}
-blocked_users: dict[int, dict] = {}
+blocked_users = BanTable()
+
+# formatted ban text per user: {uid: ((until, reason), msg)}
+ban_messages: dict[int, tuple[tuple, str]] = {}
 
 # helper – check if a user is blocked right now
 def is_currently_blocked(uid: int) -> tuple[bool, str | None]:
@@ -698,6 +1828,11 @@ def is_currently_blocked(uid: int) -> tuple[bool, str | None]:
 
     if datetime.utcnow() < info["until"]:
         # Block अभी active है
+        key = (info["until"], info.get("reason"))
+        cached = ban_messages.get(uid)
+        if cached and cached[0] == key:
+            return True, cached[1]
+
         until_str = info["until"].strftime("%d %B %Y at %H:%M UTC")
         reason = info.get("reason", "Rule Violation")
 
@@ -712,6 +1847,7 @@ def is_currently_blocked(uid: int) -> tuple[bool, str | None]:
             f"⏰ You will be able to use the chat again at {until_str}.\n\n"
             "⚠️ If you believe this was a mistake, contact the admin."
         )
+        ban_messages[uid] = (key, msg)
         return True, msg
 
     return False, None  # Block expire हो गया
@@ -719,22 +1855,140 @@ def is_currently_blocked(uid: int) -> tuple[bool, str | None]:
 # escalation table (in hours)
 BLOCK_STEPS = [24, 48, 96, 480, 720]           # 1d,2d,4d,20d,30d
 
+# static admin menus
+ADMIN_ROOT_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Reports",       callback_data="admin:reports")],
+    [InlineKeyboardButton("🚫 Blocked Users", callback_data="admin:blocked")],
+    [InlineKeyboardButton("📊 Stats",         callback_data="admin:stats")],
+    [InlineKeyboardButton("📈 Trends",        callback_data="admin:trends")],
+    [InlineKeyboardButton("🔬 Profile 30s",   callback_data="admin:profile")],
+])
+ADMIN_REPORTS_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🆕 All open",      callback_data="rep_filter:all")],
+    [InlineKeyboardButton("🔢 Most reported", callback_data="rep_filter:top")],
+    [InlineKeyboardButton("🗓 Last 7 days",   callback_data="rep_filter:7d")],
+    [InlineKeyboardButton("⚠️ 3+ reports",    callback_data="rep_filter:3+")],
+    [InlineKeyboardButton("🔙 Back",          callback_data="admin:back")],
+])
+BACK_TO_ADMIN_ROW   = [InlineKeyboardButton("🔙 Back", callback_data="admin:back")]
+BACK_TO_REPORTS_ROW = [InlineKeyboardButton("🔙 Back", callback_data="admin:reports")]
+BACK_TO_BLOCKED_ROW = [InlineKeyboardButton("🔙 Back", callback_data="admin:blocked")]
+BACK_TO_ADMIN_KB    = InlineKeyboardMarkup([BACK_TO_ADMIN_ROW])
+BACK_TO_REPORTS_KB  = InlineKeyboardMarkup([BACK_TO_REPORTS_ROW])
+BACK_TO_BLOCKED_KB  = InlineKeyboardMarkup([BACK_TO_BLOCKED_ROW])
+
+# on-demand CPU profile of the event loop, started from the admin panel
+PROFILE_SECONDS = 30
+profiler = SamplingProfiler(os.path.abspath(__file__),
+                            skip=(ChatOrderedProcessor.process_update, ChatOrderedProcessor.do_process_update,
+                                  LaneRateLimiter._dispatch))
+
+async def run_profile(bot, admin_id: int):
+    try:
+        result = await profiler.profile(PROFILE_SECONDS)
+    except RuntimeError:
+        return
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    summary = result.summary()
+    await bot.send_document(
+        admin_id, result.collapsed().encode(), filename=f"profile-{stamp}.folded",
+        caption=summary[:1024], rate_limit_args=LANE_ADMIN,
+    )
+    if len(summary) > 1024:
+        await bot.send_message(admin_id, summary, rate_limit_args=LANE_ADMIN)
+
+# rollup summary for the admin panel
+SPARK = "▁▂▃▄▅▆▇█"
+
+def sparkline(values) -> str:
+    top = max(values, default=0) or 1
+    return "".join(SPARK[round(v / top * (len(SPARK) - 1))] for v in values)
+
+def fmt_duration(seconds: float) -> str:
+    if seconds < 10:
+        return f"{seconds:.1f}s"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+def trends_text() -> str:
+    def counts(series):
+        return " / ".join(str(series.window(w)[0]) for w in TREND_WINDOWS.values())
+
+    def means(series, fmt):
+        out = []
+        for w in TREND_WINDOWS.values():
+            n, total = series.window(w)
+            out.append(fmt(total / n) if n else "–")
+        return " / ".join(out)
+
+    hourly = [count for _, count, _ in TS_MATCHES.points("hour", 24)]
+    return (
+        "📈 *Trends* (1h / 24h / 7d)\n"
+        f"🤝 Matches: {counts(TS_MATCHES)}\n"
+        f"⏱ Avg chat: {means(TS_CHAT_SEC, fmt_duration)}\n"
+        f"💬 Msgs per chat: {means(TS_CHAT_MSGS, lambda v: f'{v:.1f}')}\n"
+        f"⏳ Avg wait: {means(TS_WAIT_SEC, fmt_duration)}\n"
+        f"🚩 Reports: {counts(TS_REPORTS)}\n\n"
+        f"Matches per hour, last 24h:\n{sparkline(hourly)}"
+    )
+
 # ─────────────  ADMIN PANEL  ─────────────
 async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Shows the root admin panel (only for admins)."""
     if update.effective_user.id not in admins:
         return            # non-admin → ignore, fallback handled elsewhere
 
-    root_buttons = InlineKeyboardMarkup([
-        [InlineKeyboardButton("📋 Reports",       callback_data="admin:reports")],
-        [InlineKeyboardButton("🚫 Blocked Users", callback_data="admin:blocked")],
-        [InlineKeyboardButton("📊 Stats",         callback_data="admin:stats")],
-    ])
     await update.effective_message.reply_text(
-        "🛡 *Admin Panel*", reply_markup=root_buttons, parse_mode="Markdown"
+        "🛡 *Admin Panel*", reply_markup=ADMIN_ROOT_KB, parse_mode="Markdown"
     )
 
 
+# ─────────────  ADMIN LIST PAGES  ─────────────
+# Cursor-paged: a "Next" button carries the last key shown, so each page is
+# one bisect plus PAGE_SIZE rows (Telegram allows ~100 buttons per message).
+PAGE_SIZE = 20
+
+# rep_filter name → (order, min_count, max age)
+REPORT_FILTERS = {
+    "all": ("recency", 1, None),
+    "top": ("count", 1, None),
+    "7d":  ("recency", 1, timedelta(days=7)),
+    "3+":  ("count", REPORT_ALERT_MIN, None),
+}
+
+def blocked_page(after: tuple | None) -> list[list[InlineKeyboardButton]]:
+    """Rows for one page of bans, soonest expiry first."""
+    keys, more = blocked_users.by_expiry.page(after, PAGE_SIZE)
+    now = datetime.utcnow()
+    rows = [[InlineKeyboardButton(f"{uid} ({int((until - now).total_seconds() // 3600)}h)",
+                                  callback_data=f"blk_info:{uid}")]
+            for until, uid in keys]
+    nav = []
+    if after is not None:
+        nav.append(InlineKeyboardButton("⏮ First", callback_data="admin:blocked"))
+    if more:
+        until, uid = keys[-1]
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"blk_page:{to_us(until)}:{uid}"))
+    return rows + ([nav] if nav else [])
+
+def report_page(flt: str, after: tuple | None) -> list[list[InlineKeyboardButton]]:
+    """Rows for one page of reported users under filter ``flt``."""
+    order, min_count, max_age = REPORT_FILTERS.get(flt, REPORT_FILTERS["all"])
+    since = datetime.utcnow() - max_age if max_age else None
+    uids, cursor = report_history.open_page(order, after, PAGE_SIZE, min_count, since)
+    rows = [[InlineKeyboardButton(str(uid), callback_data=f"rep_info:{uid}")] for uid in uids]
+    nav = []
+    if after is not None:
+        nav.append(InlineKeyboardButton("⏮ First", callback_data=f"rep_filter:{flt}"))
+    if cursor is not None:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"rep_filter:{flt}:{cursor[0]}:{cursor[1]}"))
+    return rows + ([nav] if nav else [])
+
+
 # ─────────────  ADMIN CALLBACKS  ─────────────
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """All inline-button clicks that start with admin:, rep_filter:, rep_info:, blk_ …"""
@@ -755,78 +2009,62 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
         await admin(update, context)      # show root again
         return
-    from asyncio import sleep
-
-async def unblock_expired_users(bot):
-    while True:
-        now = datetime.utcnow()
-        to_unblock = []
-
-        for uid, info in blocked_users.items():
-            if now >= info["until"]:
-                to_unblock.append(uid)
-
-        for uid in to_unblock:
-            blocked_users.pop(uid, None)
-            try:
-                await bot.send_message(
-                    uid,
-                    "✅ Your ban has expired. You can now use the chat again.\nUse /start to begin."
-                )
-            except:
-                pass
-
-        await sleep(60)  # Check every 1 minute
 
+    # ====  PROFILER  ============================================
+    if data == "admin:profile":
+        if profiler.running:
+            await query.edit_message_text("🔬 A profile is already running.", reply_markup=BACK_TO_ADMIN_KB)
+            return
+        spawn(run_profile(context.bot, uid))
+        await query.edit_message_text(
+            f"🔬 Profiling the bot for {PROFILE_SECONDS}s…\n"
+            "📄 You'll get a flamegraph file (collapsed stacks) and a summary.",
+            reply_markup=BACK_TO_ADMIN_KB
+        )
+        return
 
     # ====  REPORTS root menu  ==================================
     if data == "admin:reports":
-        buttons = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🆕 All open",    callback_data="rep_filter:all")],
-            [InlineKeyboardButton("🗓 Last 7 days", callback_data="rep_filter:7d")],
-            [InlineKeyboardButton("⚠️ 3+ reports",  callback_data="rep_filter:3+")],
-            [InlineKeyboardButton("🔙 Back",        callback_data="admin:back")],
-        ])
         await query.edit_message_text(
             "📋 *Open Reports* – choose filter:",
-            reply_markup=buttons, parse_mode="Markdown"
+            reply_markup=ADMIN_REPORTS_KB, parse_mode="Markdown"
         )
         return
 
     # ====  BLOCKED users list  =================================
-    if data == "admin:blocked":
+    if data == "admin:blocked" or data.startswith("blk_page:"):
         if not blocked_users:
             await query.edit_message_text(
                 "✅ No users are currently blocked.",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin:back")]])
+                reply_markup=BACK_TO_ADMIN_KB
             )
             return
 
-        rows = []
-        for uid_, info in blocked_users.items():
-            hrs_left = int((info["until"] - datetime.utcnow()).total_seconds() // 3600)
-            rows.append(
-                [InlineKeyboardButton(f"{uid_} ({hrs_left}h)", callback_data=f"blk_info:{uid_}")]
-            )
-        rows.append([InlineKeyboardButton("🔙 Back", callback_data="admin:back")])
+        after = None
+        if data.startswith("blk_page:"):
+            _, until_us, uid_ = data.split(":")
+            after = (from_us(int(until_us)), int(uid_))
+        rows = blocked_page(after)
+        rows.append(BACK_TO_ADMIN_ROW)
 
         await query.edit_message_text(
-            "🚫 *Blocked Users* (UID – hours left):",
+            f"🚫 *Blocked Users* ({len(blocked_users)}, soonest expiry first – UID, hours left):",
             reply_markup=InlineKeyboardMarkup(rows), parse_mode="Markdown"
         )
         return
 
     # ====  STATS  ==============================================
     if data == "admin:stats":
-        total_users   = len(users)
-        profiles_done = sum(1 for u in users.values() if is_profile_complete_dict(u))
+        total_users   = stats["users_total"]
+        profiles_done = stats["profiles_done"]
         active        = len(active_chats) // 2
         searching     = len(waiting_users)
-        new_today     = sum(1 for u in users.values()
-                            if u.get('created') == datetime.utcnow().date().isoformat())
-        online        = len({*active_chats.keys(), *waiting_users})
+        new_today     = new_users_today()
+        online        = len(active_chats) + len(waiting_users)
         blocked_cnt   = len(blocked_users)
-        total_reports = len([r for r in report_history if not r["handled"]])
+        total_reports = report_history.open_total
+        throttled     = admission.throttled
+        thr           = admission.counts
 
         text = (
             "📊 *Gabbar Chat Stats:*\n"
@@ -837,39 +2075,35 @@ async def unblock_expired_users(bot):
             f"🆕 New Users Today: {new_today}\n"
             f"🧑‍💻 Currently Online: {online}\n"
             f"🚫 Blocked Users: {blocked_cnt}\n"
-            f"📩 Total Open Reports: {total_reports}"
+            f"📩 Total Open Reports: {total_reports}\n"
+            f"🐢 Throttled Updates: {throttled} "
+            f"(msg {thr['message']} / cmd {thr['command']} / btn {thr['callback']})\n"
+            f"🚦 Refused (pool full): {thr['pool_full']}"
         )
         await query.edit_message_text(
             text, parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin:back")]])
+            reply_markup=BACK_TO_ADMIN_KB
         )
         return
 
+    # ====  TRENDS  =============================================
+    if data == "admin:trends":
+        await query.edit_message_text(trends_text(), parse_mode="Markdown", reply_markup=BACK_TO_ADMIN_KB)
+        return
+
     # ========== REPORT FILTER HANDLING =========================
     if data.startswith("rep_filter:"):
-        flt = data.split(":")[1]
-        open_reports = [r for r in report_history if not r["handled"]]
-
-        if flt == "7d":
-            cutoff = datetime.utcnow() - timedelta(days=7)
-            open_reports = [r for r in open_reports if r["time"] >= cutoff]
+        _, flt, *cursor = data.split(":")
+        after = (int(cursor[0]), int(cursor[1])) if cursor else None
 
-        if flt == "3+":
-            counts = {}
-            for r in open_reports:
-                counts[r["reported"]] = counts.get(r["reported"], 0) + 1
-            open_reports = [r for r in open_reports if counts[r["reported"]] >= 3]
-
-        if not open_reports:
+        rows = report_page(flt, after)
+        if not rows:
             await query.edit_message_text(
                 "🎉 No reports in this filter.",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin:reports")]])
+                reply_markup=BACK_TO_REPORTS_KB
             )
             return
-
-        rows = [[InlineKeyboardButton(str(r["reported"]), callback_data=f"rep_info:{r['reported']}")]
-                for r in open_reports[:50]]
-        rows.append([InlineKeyboardButton("🔙 Back", callback_data="admin:reports")])
+        rows.append(BACK_TO_REPORTS_ROW)
 
         await query.edit_message_text(
             "📋 *Select a user to review:*",
@@ -880,13 +2114,19 @@ async def unblock_expired_users(bot):
     # ========== REPORT DETAILS  ================================
     if data.startswith("rep_info:"):
         rid = int(data.split(":")[1])
-        user_reports = [r for r in report_history if r["reported"] == rid]
+        user_reports = report_history.for_user(rid)
+        if not user_reports:
+            await query.edit_message_text(
+                f"🎉 No reports for `{rid}`.", parse_mode="Markdown",
+                reply_markup=BACK_TO_REPORTS_KB
+            )
+            return
         total  = len(user_reports)
         latest = user_reports[-1]
 
         btns = InlineKeyboardMarkup([
             [InlineKeyboardButton("🚫 Block", callback_data=f"blk_do:{rid}")],
-            [InlineKeyboardButton("🔙 Back", callback_data="admin:reports")]
+            BACK_TO_REPORTS_ROW
         ])
         await query.edit_message_text(
             f"🗒 *Reports for* `{rid}`\n"
@@ -905,7 +2145,7 @@ async def unblock_expired_users(bot):
 
         btns = InlineKeyboardMarkup([
             [InlineKeyboardButton("✅ Unblock", callback_data=f"blk_un:{rid}")],
-            [InlineKeyboardButton("🔙 Back",   callback_data="admin:blocked")]
+            BACK_TO_BLOCKED_ROW
         ])
         await query.edit_message_text(
             f"🚫 *Blocked user* `{rid}`\n"
@@ -923,49 +2163,121 @@ async def unblock_expired_users(bot):
         hours = BLOCK_STEPS[min(cnt, len(BLOCK_STEPS) - 1)]
         until = datetime.utcnow() + timedelta(hours=hours)
         blocked_users[rid] = {"until": until, "count": cnt + 1, "reason": "Admin"}
-
-        # mark their open reports handled
-        for r in report_history:
-            if r["reported"] == rid and not r["handled"]:
-                r["handled"] = True
+        save_block(rid)           # also marks their open reports handled
+        schedule_unblock(rid, until)
+        waiting_users.remove(rid)
 
         await query.edit_message_text(
             f"🚫 User `{rid}` blocked for {hours} hours.",
             parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin:reports")]])
+            reply_markup=BACK_TO_REPORTS_KB
         )
         return
 
-# ========== UNBLOCK (Manual by Admin) ======================
-if data.startswith("blk_un:"):
-    rid = int(data.split(":")[1])
-    blocked_users.pop(rid, None)
-
-    await query.edit_message_text(
-        f"✅ User `{rid}` unblocked.",
-        parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="admin:blocked")]])
-    )
+    # ========== UNBLOCK (Manual by Admin) ======================
+    if data.startswith("blk_un:"):
+        rid = int(data.split(":")[1])
+        drop_block(rid)
 
-    # 🔔 Notify user
-    try:
-        await context.bot.send_message(
-            rid,
-            "✅ You have been unblocked and can now use the chat again.\nUse /start to begin."
+        await query.edit_message_text(
+            f"✅ User `{rid}` unblocked.",
+            parse_mode="Markdown",
+            reply_markup=BACK_TO_BLOCKED_KB
         )
-    except:
-        pass  # Bot can't reach user
-    return
 
-# ─────────────  BLOCK-CHECK AT START  ─────────────
-def is_profile_complete_dict(d: dict) -> bool:
-    return "gender" in d and "language" in d
+        # 🔔 Notify user
+        try:
+            await context.bot.send_message(
+                rid,
+                "✅ You have been unblocked and can now use the chat again.\nUse /start to begin.",
+                rate_limit_args=LANE_ADMIN
+            )
+        except TelegramError:
+            pass  # Bot can't reach user
+        return
+
+
+# ─────────────  BAN EXPIRY  ─────────────
+
+# min-heap of (until, uid).  Re-blocks push a new entry and manual unblocks
+# just drop the user from blocked_users – stale heap entries are recognised
+# on pop (until no longer matches) and skipped.
+ban_expiry_heap: list[tuple[datetime, int]] = []
+_ban_wakeup = asyncio.Event()
+
+def schedule_unblock(uid: int, until: datetime):
+    heapq.heappush(ban_expiry_heap, (until, uid))
+    if ban_expiry_heap[0] == (until, uid):
+        _ban_wakeup.set()      # new earliest expiry → re-arm the sleeper
+
+async def unblock_expired_users(bot):
+    while True:
+        now = datetime.utcnow()
+        while ban_expiry_heap and ban_expiry_heap[0][0] <= now:
+            until, uid = heapq.heappop(ban_expiry_heap)
+            info = blocked_users.get(uid)
+            if not info or info["until"] != until:
+                continue       # unblocked or re-blocked since
+
+            drop_block(uid)
+            if not owns_user(uid):
+                continue       # another worker tells this user
+            try:
+                await bot.send_message(
+                    uid,
+                    "✅ Your ban has expired. You can now use the chat again.\nUse /start to begin.",
+                    rate_limit_args=LANE_ADMIN
+                )
+            except Exception:
+                pass
+
+        _ban_wakeup.clear()
+        timeout = (ban_expiry_heap[0][0] - datetime.utcnow()).total_seconds() if ban_expiry_heap else None
+        try:
+            await asyncio.wait_for(_ban_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+# ─────────────  PRE-DISPATCH GATE  ─────────────
+async def onboarding_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs in group -1 before every other handler, once per update.
+
+    The user is made resident first (see Hot user set).  Blocked users get
+    the ban text; messages from users with an incomplete
+    profile get the next onboarding step.  Either way the update stops here,
+    so the handlers below can assume an unblocked user with a full profile
+    (except /start, which drives onboarding, and /admin).
+    """
+    user = update.effective_user
+    if user is None:
+        return
+    touch_user(user.id)
+
+    is_blk, msg = is_currently_blocked(user.id)
+    if is_blk:
+        if update.callback_query:
+            await update.callback_query.answer()
+        if update.effective_message:
+            await update.effective_message.reply_text(msg)
+        raise ApplicationHandlerStop
+
+    message = update.message
+    if message is None:
+        return
+    ensure_user(user.id)
+    if users.is_complete(user.id):
+        return
+    command = message.text.split(maxsplit=1)[0].split("@")[0] if message.text else None
+    if command == "/start" or (command == "/admin" and user.id in admins):
+        return
 
-# (यह छोटा check ज़रूरत अनुसार /start और message_handler की शुरुआत में जोड़ें)
-# is_blk, msg = is_currently_blocked(user_id)
-# if is_blk:
-#     await update.message.reply_text(msg)
-#     return ConversationHandler.END
+    await message.reply_text("🚫 Please complete your profile first.")
+    if users.gender(user.id) is None:
+        await message.reply_text(ASK_GENDER, reply_markup=GENDER_KB)
+    else:
+        await message.reply_text(ASK_LANGUAGE, reply_markup=LANGUAGE_KB)
+    raise ApplicationHandlerStop
 
 
 # ─────────────  CONVERSATION HANDLERS  ─────────────
@@ -990,22 +2302,203 @@ settings_conv = ConversationHandler(
     fallbacks=[CallbackQueryHandler(cancel_settings, pattern="^cancel_settings$")],
 )
 
-if __name__ == "__main__":
-    import os
-    from telegram.ext import ApplicationBuilder, filters
-    from flask import Flask
-    from threading import Thread
-
-    TOKEN = os.getenv("BOT_TOKEN")
-
-    # --- Telegram Bot Setup ---
-    app = (
-        ApplicationBuilder()
-        .token(TOKEN)
-        .build()
-    )
-
-    # Handlers setup
+# ─────────────  APPLICATION / SERVING  ─────────────
+BOT_MODE        = os.getenv("BOT_MODE", "polling")        # "polling" | "webhook" | "shard" (set by shard.py)
+PORT            = int(os.getenv("PORT", "8080"))
+WEBHOOK_URL     = os.getenv("WEBHOOK_URL", "")             # public https base, e.g. https://bot.example.com
+WEBHOOK_PATH    = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET  = os.getenv("WEBHOOK_SECRET", "")
+BOT_API_URL     = os.getenv("BOT_API_URL", "")             # self-hosted / fake Bot API, e.g. http://127.0.0.1:8081
+
+_background_tasks: set = set()
+_writers: list = []        # store.run / journal.run tasks (see on_shutdown)
+_web_runner: web.AppRunner | None = None
+send_limiter: LaneRateLimiter | None = None     # set by build_application, read by /metrics
+
+# ── scrape-time gauges for /metrics ──
+def _waiting_by_bucket():
+    if isinstance(waiting_users, MatchQueue):
+        return waiting_users.bucket_sizes()
+    return {("all", "all"): len(waiting_users)}
+
+def _ban_overdue_seconds():
+    if not ban_expiry_heap:
+        return 0
+    return max(0.0, (datetime.utcnow() - ban_expiry_heap[0][0]).total_seconds())
+
+registry.gauge("gabbar_waiting_users", "Users in the search pool per bucket", _waiting_by_bucket, ("language", "gender"))
+registry.gauge("gabbar_active_chats", "Chats in progress", lambda: len(active_chats) // 2)
+registry.gauge("gabbar_users", "Known users", lambda: stats["users_total"])
+registry.gauge("gabbar_users_resident", "Users whose profile is in memory", lambda: len(users))
+registry.gauge("gabbar_unreachable_users", "Users known to be unreachable", lambda: len(unreachable_users))
+registry.gauge("gabbar_open_reports", "Reports not yet handled", lambda: report_history.open_total)
+registry.gauge("gabbar_blocked_users", "Users with a ban record", lambda: len(blocked_users))
+# the heap keeps stale entries after unbans and re-bans; the live bans are what's pending
+registry.gauge("gabbar_ban_expiry_backlog", "Bans waiting to expire", lambda: len(blocked_users))
+registry.gauge("gabbar_ban_expiry_overdue_seconds", "How late the earliest due unban is", _ban_overdue_seconds)
+registry.gauge("gabbar_send_queue_depth", "Outbound calls queued per lane",
+               lambda: send_limiter.depth() if send_limiter else {}, ("lane",))
+registry.gauge("gabbar_throttled_updates_total", "Updates dropped by admission control",
+               lambda: {k: v for k, v in admission.counts.items() if k != "pool_full"}, ("kind",), kind="counter")
+registry.gauge("gabbar_pool_full_total", "Searches refused because the pool was at WAITING_POOL_CAP",
+               lambda: admission.counts["pool_full"], kind="counter")
+def _rollup_reader(field: int):
+    """{(series, window): count or sum} over TREND_WINDOWS, computed at scrape time."""
+    return lambda: {(s.name, label): s.window(seconds)[field]
+                    for s in rollups for label, seconds in TREND_WINDOWS.items()}
+
+registry.gauge("gabbar_rollup_count", "Events recorded per rollup series over a trailing window",
+               _rollup_reader(0), ("series", "window"))
+registry.gauge("gabbar_rollup_sum", "Sum of recorded values (seconds, messages) over a trailing window",
+               _rollup_reader(1), ("series", "window"))
+registry.gauge("gabbar_store_pending_writes", "Dirty keys waiting for the next SQLite flush", lambda: store.pending)
+
+async def metrics_view(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+def spawn(coro):
+    """create_task that keeps a reference so the task isn't garbage-collected."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def on_startup(application):
+    spawn(unblock_expired_users(application.bot))
+    spawn(admin_notifier.run(application.bot))
+    _writers[:] = [spawn(store.run()), spawn(journal.run(current_state))]
+    spawn(evict_loop(application))
+    if REAP_IDLE:
+        spawn(idle_reaper_loop(application.bot))
+    if MATCH_TICK_MS and not shard_client:     # workers match through the coordinator
+        spawn(match_tick_loop(application))
+
+async def on_shutdown(application):
+    # the writers are stopped, not cancelled: a cancelled task's to_thread
+    # call keeps running and would race close() below
+    store.stop()
+    journal.stop()
+    for task in list(_background_tasks):
+        if task not in _writers:
+            task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    if _web_runner is not None:
+        await _web_runner.cleanup()
+    store.close()
+    journal.close()
+
+async def health(request):
+    return web.Response(text="✅ Bot is alive!")
+
+def make_web_app(application, with_webhook: bool) -> web.Application:
+    """Health and /metrics routes always; the Telegram webhook route only in webhook mode."""
+    async def telegram_webhook(request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):   # str form rejects non-ASCII
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception:
+            return web.Response(status=400)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    web_app = web.Application()
+    web_app.router.add_get("/", health)
+    web_app.router.add_get("/metrics", metrics_view)
+    if with_webhook:
+        web_app.router.add_post(WEBHOOK_PATH, telegram_webhook)
+    return web_app
+
+async def start_web(application, with_webhook: bool, port: int = PORT):
+    global _web_runner
+    _web_runner = web.AppRunner(make_web_app(application, with_webhook), access_log=None)
+    await _web_runner.setup()
+    await web.TCPSite(_web_runner, "0.0.0.0", port).start()
+
+async def serve_webhook(application):
+    """Webhook mode: aiohttp receives updates on the bot's own event loop."""
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise SystemExit("WEBHOOK_URL and WEBHOOK_SECRET are required in webhook mode")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        await on_startup(application)
+        await application.start()
+        await start_web(application, with_webhook=True)
+        await application.bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                          allowed_updates=Update.ALL_TYPES)
+        print(f"✅ Webhook listening on :{PORT}{WEBHOOK_PATH}")
+        await stop.wait()
+        await application.stop()
+        await on_shutdown(application)
+
+def apply_shard_event(event: dict):
+    """Mirror a coordinator broadcast into the local replicas (no re-broadcast)."""
+    kind = event["ev"]
+    if kind == "pair":
+        a, b = event["a"], event["b"]
+        active_chats[a] = b
+        active_chats[b] = a
+        remember_pair(a, b)           # repeat on the pairing worker is harmless
+        open_sessions(a, b)
+        waiting_users.discard(a)
+        waiting_users.discard(b)
+    elif kind == "unpair":
+        active_chats.pop(event["a"], None)
+        active_chats.pop(event["b"], None)
+        close_sessions(event["a"], event["b"])
+    elif kind == "block":
+        blocked_users[event["uid"]] = event["info"]
+        waiting_users.discard(event["uid"])
+        schedule_unblock(event["uid"], event["info"]["until"])
+    elif kind == "unblock":
+        blocked_users.pop(event["uid"], None)
+        ban_messages.pop(event["uid"], None)
+
+async def serve_shard(application):
+    """Worker mode: updates arrive from the coordinator instead of Telegram."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def on_update(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    async with application:
+        # losing the coordinator stops the worker; the supervisor starts a fresh one
+        replica = await shard_client.connect(apply_shard_event, on_update, on_lost=stop.set)
+        active_chats.clear()
+        active_chats.update(replica["active_chats"])
+        blocked_users.clear()
+        blocked_users.update(replica["blocked_users"])
+        for uid, info in blocked_users.items():
+            schedule_unblock(uid, info["until"])
+
+        await on_startup(application)
+        await application.start()
+        await start_web(application, with_webhook=False, port=PORT + 1 + SHARD_ID)   # health + /metrics
+        print(f"✅ Worker {SHARD_ID}/{SHARD_COUNT} ready")
+        await stop.wait()
+        await application.stop()
+        lost = not shard_client.connected
+        await shard_client.close()
+        await on_shutdown(application)
+    if lost:
+        raise SystemExit(1)
+
+async def polling_startup(application):
+    await on_startup(application)
+    await start_web(application, with_webhook=False)
+
+def register_handlers(app: Application):
+    app.add_handler(TypeHandler(Update, admission_gate), group=-2)
+    app.add_handler(TypeHandler(Update, onboarding_gate), group=-1)
     app.add_handler(conv)
     app.add_handler(settings_conv)
     app.add_handler(CallbackQueryHandler(cancel_settings, pattern="^cancel_settings$"))
@@ -1024,23 +2517,54 @@ if __name__ == "__main__":
                                          pattern="^(admin:|rep_filter:|rep_info:|blk_).*"))
 
     app.add_handler(MessageHandler(filters.ALL, message_handler))
+    instrument_handlers(app)
+
+def instrument_handlers(app: Application):
+    """Time every handler callback into gabbar_handler_seconds{handler=<function name>}."""
+    def walk(handlers):
+        for h in handlers:
+            if isinstance(h, ConversationHandler):
+                walk(h.entry_points)
+                for state_handlers in h.states.values():
+                    walk(state_handlers)
+                walk(h.fallbacks)
+            elif not getattr(h.callback, "metrics_timed", False):   # conv handlers are shared module objects
+                h.callback = timed(h.callback, HANDLER_SECONDS.labels(h.callback.__name__))
+
+    for handlers in app.handlers.values():
+        walk(handlers)
+
+def build_application(token: str, post_init=None) -> Application:
+    global send_limiter
+    send_limiter = LaneRateLimiter(unreachable=unreachable_users)
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .rate_limiter(send_limiter)
+        .post_init(post_init)
+        .post_shutdown(on_shutdown)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+    if CONCURRENT_UPDATES:
+        builder = builder.concurrent_updates(ChatOrderedProcessor(CONCURRENT_UPDATES))
+    app = builder.build()
+    send_limiter.on_unreachable = lambda uid: mark_unreachable(app.bot, uid)
+    register_handlers(app)
+    return app
 
-    print("✅ Gabbar Chat is starting...")
-
-    # --- Flask Server in Background ---
-    flask_app = Flask(__name__)
-
-    @flask_app.route('/')
-    def home():
-        return "✅ Bot is alive!"
-
-    def run_flask():
-        flask_app.run(host='0.0.0.0', port=8080)
+if __name__ == "__main__":
+    TOKEN = os.getenv("BOT_TOKEN")
 
-    Thread(target=run_flask).start()
-    import asyncio
-asyncio.get_event_loop().create_task(unblock_expired_users(app.bot))
+    # --- Restore state from disk ---
+    load_state()
 
+    print("✅ Gabbar Chat is starting...")
 
-    # --- Telegram Bot in Main Thread ---
-    app.run_polling()
+    if BOT_MODE == "webhook":
+        asyncio.run(serve_webhook(build_application(TOKEN)))
+    elif BOT_MODE == "shard":
+        asyncio.run(serve_shard(build_application(TOKEN)))
+    else:
+        # --- Polling; health route served by aiohttp on the same loop ---
+        build_application(TOKEN, post_init=polling_startup).run_polling()
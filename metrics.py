@@ -0,0 +1,136 @@
+# Prometheus-style metrics for Gabbar Chat Bot.
+#
+# Everything is touched from the bot's single event loop, so counters and
+# histograms are plain ints/floats with no locks.  Hot paths grab their
+# Counter / Histogram object once (at import or first use) and then only do
+# an attribute increment, or a bisect plus two adds for a histogram.
+# Gauges (and counters kept elsewhere) are read through callables, only when
+# /metrics is scraped.
+
+import functools
+import time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Family:
+    """One metric name; children are keyed by their label values."""
+
+    def __init__(self, name: str, kind: str, help_text: str, label_names=(), factory=None):
+        self.name, self.kind, self.help = name, kind, help_text
+        self.label_names = tuple(label_names)
+        self.factory = factory
+        self.children: dict[tuple, object] = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.factory()
+        return child
+
+    def render(self, out: list):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for values, child in self.children.items():
+            labels = dict(zip(self.label_names, values))
+            if self.kind == "counter":
+                out.append(f"{self.name}{_labels(labels)} {child.value}")
+                continue
+            cumulative = 0
+            for le, n in zip((*child.buckets, "+Inf"), child.counts):
+                cumulative += n
+                out.append(f"{self.name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(labels)} {child.sum}")
+            out.append(f"{self.name}_count{_labels(labels)} {child.count}")
+
+
+class CallbackFamily:
+    """Value read at scrape time; ``fn`` returns a number or ``{label_values: number}``."""
+
+    def __init__(self, name: str, kind: str, help_text: str, fn, label_names=()):
+        self.name, self.kind, self.help, self.fn = name, kind, help_text, fn
+        self.label_names = tuple(label_names)
+
+    def render(self, out: list):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        value = self.fn()
+        if not isinstance(value, dict):
+            out.append(f"{self.name} {value}")
+            return
+        for values, v in value.items():
+            values = values if isinstance(values, tuple) else (values,)
+            out.append(f"{self.name}{_labels(dict(zip(self.label_names, values)))} {v}")
+
+
+class Registry:
+    def __init__(self):
+        self._families: list = []
+
+    def counter(self, name: str, help_text: str, label_names=()):
+        family = Family(name, "counter", help_text, label_names, Counter)
+        self._families.append(family)
+        return family if label_names else family.labels()
+
+    def histogram(self, name: str, help_text: str, label_names=(), buckets=LATENCY_BUCKETS):
+        family = Family(name, "histogram", help_text, label_names, functools.partial(Histogram, buckets))
+        self._families.append(family)
+        return family if label_names else family.labels()
+
+    def gauge(self, name: str, help_text: str, fn, label_names=(), kind: str = "gauge"):
+        """Register a scrape-time reader; ``kind="counter"`` for totals kept elsewhere."""
+        self._families.append(CallbackFamily(name, kind, help_text, fn, label_names))
+
+    def render(self) -> str:
+        out: list[str] = []
+        for family in self._families:
+            family.render(out)
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+
+def timed(fn, histogram: Histogram):
+    """Wrap an ``async`` callable so every call's wall time lands in ``histogram``."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    wrapper.metrics_timed = True
+    return wrapper
@@ -0,0 +1,100 @@
+# Low-overhead sampling profiler for the running bot.
+#
+# A helper thread wakes every ``interval`` seconds, grabs the event-loop
+# thread's current Python stack with sys._current_frames() and counts it.
+# Only code objects are stored while sampling; names are formatted once at
+# the end.  At the default 100 Hz the loop thread loses a few microseconds
+# per sample, so it is safe to run on a live bot for a minute.
+#
+# Output is the collapsed-stack format ("root;…;leaf count" per line) that
+# flamegraph.pl, speedscope and inferno read directly, plus a text summary.
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+IDLE_FUNCS = {"select", "poll", "epoll", "kqueue", "_run_once"}   # loop waiting for I/O
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class ProfileResult:
+    def __init__(self, stacks: Counter, samples: int, seconds: float, app_file: str, skip=frozenset()):
+        self.stacks = stacks              # {(leaf code, …, root code): count}
+        self.samples = samples
+        self.seconds = seconds
+        self.app_file = app_file
+        self.skip = skip                  # code objects of plumbing that wraps handlers
+
+    def collapsed(self) -> str:
+        lines = (";".join(_frame_name(c) for c in reversed(stack)) + f" {n}"
+                 for stack, n in self.stacks.most_common())
+        return "\n".join(lines) + "\n"
+
+    def _owner(self, stack) -> str:
+        """Outermost function in the bot's own file, i.e. the handler or loop that got the CPU.
+
+        The module body (``<module>``, which starts the loop) is at the root
+        of every sample, and update processors / dispatchers in ``skip`` sit
+        above every handler they run, so neither counts.
+        """
+        for code in reversed(stack):
+            if code.co_filename == self.app_file and code.co_name != "<module>" and code not in self.skip:
+                return code.co_name
+        return "<idle>" if stack and stack[0].co_name in IDLE_FUNCS else "<framework>"
+
+    def summary(self, top: int = 10) -> str:
+        by_owner, by_leaf = Counter(), Counter()
+        for stack, n in self.stacks.items():
+            by_owner[self._owner(stack)] += n
+            if stack:
+                by_leaf[_frame_name(stack[0])] += n
+        total = self.samples or 1
+
+        out = [f"🔬 {self.samples} samples in {self.seconds:.0f}s"]
+        out.append("\nBy handler:")
+        out += [f"{n * 100 / total:5.1f}%  {name}" for name, n in by_owner.most_common(top)]
+        out.append("\nHottest functions (self):")
+        out += [f"{n * 100 / total:5.1f}%  {name}" for name, n in by_leaf.most_common(top)]
+        return "\n".join(out)
+
+
+class SamplingProfiler:
+    def __init__(self, app_file: str, interval: float = 0.01, skip=()):
+        """``skip``: app-file functions that only wrap handlers (never reported as the owner)."""
+        self.app_file = app_file
+        self.interval = interval
+        self.skip = frozenset(fn.__code__ for fn in skip)
+        self.running = False
+
+    def _sample(self, thread_id: int, seconds: float) -> tuple[Counter, int]:
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stacks[tuple(stack)] += 1
+            samples += 1
+            time.sleep(self.interval)
+        return stacks, samples
+
+    async def profile(self, seconds: float) -> ProfileResult:
+        """Sample the calling event loop's thread for ``seconds``; one run at a time."""
+        if self.running:
+            raise RuntimeError("profiler already running")
+        self.running = True
+        try:
+            thread_id = threading.get_ident()
+            stacks, samples = await asyncio.to_thread(self._sample, thread_id, seconds)
+        finally:
+            self.running = False
+        return ProfileResult(stacks, samples, seconds, self.app_file, self.skip)
@@ -0,0 +1,158 @@
+# Compact user profiles for Gabbar Chat Bot.
+#
+# ProfileStore replaces the old ``users = {uid: {"gender": "Male", …}}`` dict.
+# Every user gets a dense slot; profile fields live in parallel arrays indexed
+# by that slot.  Gender and language are 1-byte codes into small lookup
+# tables, age is a uint8 and the sign-up day a uint16 day number, so a user
+# costs 5 bytes of columns plus one uid→slot dict entry.  Slots of removed
+# (evicted) users are zeroed and reused.
+#
+# On disk (SQLite rows, journal records, shard RPC) a profile is still the
+# old plain dict; ``as_dict`` / ``load`` convert at that boundary.
+
+from array import array
+from datetime import date
+
+_EPOCH = date(1970, 1, 1).toordinal()
+UNSET = 0
+
+
+class ProfileStore:
+    FIELDS = ("gender", "language", "age")
+
+    def __init__(self, genders=(), languages=()):
+        self._slot: dict[int, int] = {}
+        self._free: list[int] = []
+        self._gender = array("B")
+        self._language = array("B")
+        self._age = array("B")
+        self._created = array("H")
+        # code 0 means "not set"; unknown values get the next free code
+        self._tables = {"gender": [None, *genders], "language": [None, *languages]}
+        self._codes = {field: {v: i for i, v in enumerate(table) if i} for field, table in self._tables.items()}
+
+    # ── container protocol ──────────────────────────────────
+    def __len__(self):
+        return len(self._slot)
+
+    def __contains__(self, uid):
+        return uid in self._slot
+
+    def __iter__(self):
+        return iter(self._slot)
+
+    # ── writes ──────────────────────────────────────────────
+    def add(self, uid: int, created: str | None = None) -> int:
+        """Give ``uid`` a slot (idempotent); ``created`` is an ISO day."""
+        slot = self._slot.get(uid)
+        if slot is not None:
+            return slot
+        day = date.fromisoformat(created).toordinal() - _EPOCH if created else UNSET
+        if self._free:
+            slot = self._slot[uid] = self._free.pop()
+            self._created[slot] = day
+        else:
+            slot = self._slot[uid] = len(self._gender)
+            self._gender.append(UNSET)
+            self._language.append(UNSET)
+            self._age.append(UNSET)
+            self._created.append(day)
+        return slot
+
+    def remove(self, uid: int):
+        slot = self._slot.pop(uid)
+        self._gender[slot] = self._language[slot] = self._age[slot] = self._created[slot] = UNSET
+        self._free.append(slot)
+
+    def _code(self, field: str, value) -> int:
+        code = self._codes[field].get(value)
+        if code is None:
+            table = self._tables[field]
+            if len(table) > 255:
+                raise ValueError(f"too many distinct {field} values")
+            code = self._codes[field][value] = len(table)
+            table.append(value)
+        return code
+
+    def set(self, uid: int, field: str, value):
+        slot = self.add(uid)
+        if field == "age":
+            self._age[slot] = int(value)
+        elif field == "gender":
+            self._gender[slot] = self._code("gender", value)
+        elif field == "language":
+            self._language[slot] = self._code("language", value)
+        else:
+            raise KeyError(field)
+
+    def load(self, uid: int, profile: dict):
+        """Apply a stored profile dict (replaces whatever ``uid`` had)."""
+        slot = self.add(uid, profile.get("created"))
+        if profile.get("created"):
+            self._created[slot] = date.fromisoformat(profile["created"]).toordinal() - _EPOCH
+        self._gender[slot] = self._code("gender", profile["gender"]) if "gender" in profile else UNSET
+        self._language[slot] = self._code("language", profile["language"]) if "language" in profile else UNSET
+        self._age[slot] = int(profile.get("age") or UNSET)
+
+    def __getstate__(self):
+        # the uid→slot map as two arrays: memcpy-fast to pickle, unlike a big dict
+        state = dict(self.__dict__)
+        slot = state.pop("_slot")
+        state["_uids"], state["_slots"] = array("q", slot), array("L", slot.values())
+        return state
+
+    def __setstate__(self, state):
+        if "_uids" in state:
+            state["_slot"] = dict(zip(state.pop("_uids"), state.pop("_slots")))
+        self.__dict__.update(state)
+
+    def copy(self) -> "ProfileStore":
+        """Independent copy; the columns are memcpy'd, so this is cheap next to pickling."""
+        other = ProfileStore.__new__(ProfileStore)
+        other._slot, other._free = dict(self._slot), list(self._free)
+        other._gender, other._language = self._gender[:], self._language[:]
+        other._age, other._created = self._age[:], self._created[:]
+        other._tables = {field: list(table) for field, table in self._tables.items()}
+        other._codes = {field: dict(codes) for field, codes in self._codes.items()}
+        return other
+
+    def update(self, other):
+        """Bulk load from another ProfileStore (snapshot) or a ``{uid: dict}`` mapping (SQLite)."""
+        if isinstance(other, ProfileStore) and not self._slot:
+            self.__dict__.update(other.__dict__)
+            return
+        items = ((uid, other.as_dict(uid)) for uid in other) if isinstance(other, ProfileStore) else other.items()
+        for uid, profile in items:
+            self.load(uid, profile)
+
+    # ── reads ───────────────────────────────────────────────
+    def gender(self, uid: int) -> str | None:
+        return self._tables["gender"][self._gender[self._slot[uid]]]
+
+    def language(self, uid: int) -> str | None:
+        return self._tables["language"][self._language[self._slot[uid]]]
+
+    def age(self, uid: int) -> int | None:
+        return self._age[self._slot[uid]] or None
+
+    def created(self, uid: int) -> str | None:
+        day = self._created[self._slot[uid]]
+        return date.fromordinal(day + _EPOCH).isoformat() if day else None
+
+    def is_complete(self, uid: int) -> bool:
+        slot = self._slot.get(uid)
+        return slot is not None and bool(self._gender[slot]) and bool(self._language[slot])
+
+    def as_dict(self, uid: int) -> dict:
+        """The profile in the old dict shape (only the fields that are set)."""
+        slot = self._slot[uid]
+        out = {}
+        if self._created[slot]:
+            out["created"] = date.fromordinal(self._created[slot] + _EPOCH).isoformat()
+        if self._gender[slot]:
+            out["gender"] = self._tables["gender"][self._gender[slot]]
+        if self._language[slot]:
+            out["language"] = self._tables["language"][self._language[slot]]
+        if self._age[slot]:
+            out["age"] = self._age[slot]
+        return out
@@ -0,0 +1,447 @@
+# Multi-process deployment for Gabbar Chat Bot.
+#
+#   python shard.py --workers 4
+#
+# starts one supervisor process that runs the coordinator (matchmaking queue,
+# active_chats, blocked_users) and the update router, plus N `demo.py`
+# workers.  Each update is routed to worker `user_id % N`, so a user's
+# profile and relay handling always stay on the same worker.  Workers talk to
+# the coordinator over a Unix socket using newline-delimited JSON, and keep
+# read-only replicas of active_chats / blocked_users that the coordinator
+# keeps in sync by broadcasting every change.
+#
+# Polling starts only once every worker has said hello.  Updates for a worker
+# that is not connected (crashed, restarting) are held per shard and handed
+# over when it reconnects; the supervisor restarts any worker that exits.
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import signal
+import subprocess
+import sys
+from collections import deque
+
+from storage import StateStore, dumps, loads
+
+logger = logging.getLogger(__name__)
+
+SOCKET_PATH = "/tmp/gabbar-coordinator.sock"
+STREAM_LIMIT = 4 * 1024 * 1024      # one line = one message; updates can be large
+ROUTE_BACKLOG = 10_000              # updates held per disconnected worker
+RESTART_DELAY = 1.0                 # seconds between worker liveness checks
+
+
+# ─────────────  wire helpers  ─────────────
+def _encode(msg: dict) -> bytes:
+    return dumps(msg).encode() + b"\n"
+
+
+async def _send(writer: asyncio.StreamWriter, msg: dict):
+    writer.write(_encode(msg))
+    await writer.drain()
+
+
+# ─────────────  coordinator  ─────────────
+class Coordinator:
+    """Single owner of the cross-worker state.
+
+    Ops (request → reply):
+      hello(shard)                     → full replica of active_chats / blocked_users
+      find(uid, language, gender, profile, avoid) → {"partner", "profile", "waited"}, {"partner": None}
+                                       (queued or already queued) or {"partner": None, "in_chat": True}
+      cancel(uid)                      → bool
+      unpair(uid)                      → partner id or None
+      block(uid, info) / unblock(uid)  → True
+      stats()                          → {"waiting", "active", "workers"}
+
+    Events pushed to every worker: pair, unpair, block, unblock.  Routed
+    updates are pushed only to their owning worker.  An op that raises is
+    answered with ``{"id", "error"}``; the connection stays up.
+    """
+
+    def __init__(self, db_path: str | None = None):
+        from demo import MatchQueue          # demo imports this module, so import lazily
+
+        self.waiting = MatchQueue()
+        self.profiles: dict[int, dict] = {}  # profile snapshot of everyone waiting
+        self.active_chats: dict[int, int] = {}
+        self.blocked_users: dict[int, dict] = {}
+        self.workers: dict[int, asyncio.StreamWriter] = {}
+        self._backlog: dict[int, deque] = {}  # shard → updates routed while it was away
+        self._joined = asyncio.Event()
+        self.store = StateStore(db_path) if db_path else None
+        self._store_task: asyncio.Task | None = None
+
+    # ── persistence (optional) ──────────────────────────────
+    def load(self):
+        if self.store is None:
+            return
+        self.store.open()
+        state = self.store.load()
+        self.active_chats.update(state["active_chats"])
+        self.blocked_users.update(state["blocked_users"])
+
+    # ── broadcast ───────────────────────────────────────────
+    def broadcast(self, event: dict):
+        line = _encode(event)
+        for writer in self.workers.values():
+            writer.write(line)
+
+    def route(self, shard: int, update: dict):
+        writer = self.workers.get(shard)
+        if writer is None:
+            backlog = self._backlog.setdefault(shard, deque(maxlen=ROUTE_BACKLOG))
+            if len(backlog) == backlog.maxlen:
+                logger.warning("Backlog for worker %d full, dropping update %s", shard, backlog[0].get("update_id"))
+            backlog.append(update)
+            return
+        writer.write(_encode({"ev": "update", "data": update}))
+
+    def _flush_backlog(self, shard: int, writer: asyncio.StreamWriter):
+        backlog = self._backlog.pop(shard, ())
+        if backlog:
+            logger.info("Handing %d held updates to worker %d", len(backlog), shard)
+        for update in backlog:
+            writer.write(_encode({"ev": "update", "data": update}))
+
+    async def wait_for_workers(self, n: int):
+        while len(self.workers) < n:
+            self._joined.clear()
+            await self._joined.wait()
+
+    # ── ops ─────────────────────────────────────────────────
+    def op_hello(self, shard, writer):
+        self.workers[shard] = writer
+        self._joined.set()
+        logger.info("Worker %d connected (%d total)", shard, len(self.workers))
+        return {"active_chats": list(self.active_chats.items()),
+                "blocked_users": list(self.blocked_users.items())}
+
+    def op_find(self, uid, language, gender, profile, avoid=()):
+        if uid in self.active_chats:
+            return {"partner": None, "in_chat": True}
+        if uid in self.waiting:
+            return {"partner": None}
+        avoid = set(avoid)                   # the caller's recent partners
+        found = self.waiting.pop_partner(language, skip=lambda p: p in self.blocked_users,
+                                         avoid=avoid.__contains__ if avoid else None)
+        if found is None:
+            self.waiting.add(uid, language, gender)
+            self.profiles[uid] = profile
+            return {"partner": None}
+
+        partner, waited = found
+        self.active_chats[uid] = partner
+        self.active_chats[partner] = uid
+        if self.store:
+            self.store.put("active_chats", uid, partner)
+            self.store.put("active_chats", partner, uid)
+        self.broadcast({"ev": "pair", "a": uid, "b": partner})
+        return {"partner": partner, "profile": self.profiles.pop(partner, {}), "waited": waited}
+
+    def op_cancel(self, uid):
+        self.profiles.pop(uid, None)
+        return self.waiting.remove(uid)
+
+    def op_unpair(self, uid):
+        partner = self.active_chats.pop(uid, None)
+        if partner is None:
+            return None
+        self.active_chats.pop(partner, None)
+        if self.store:
+            self.store.delete("active_chats", uid)
+            self.store.delete("active_chats", partner)
+        self.broadcast({"ev": "unpair", "a": uid, "b": partner})
+        return partner
+
+    def op_block(self, uid, info):
+        self.blocked_users[uid] = info
+        self.op_cancel(uid)
+        if self.store:
+            self.store.put("blocked_users", uid, info)
+        self.broadcast({"ev": "block", "uid": uid, "info": info})
+        return True
+
+    def op_unblock(self, uid):
+        self.blocked_users.pop(uid, None)
+        if self.store:
+            self.store.delete("blocked_users", uid)
+        self.broadcast({"ev": "unblock", "uid": uid})
+        return True
+
+    def op_stats(self):
+        return {"waiting": len(self.waiting), "active": len(self.active_chats) // 2,
+                "workers": len(self.workers)}
+
+    # ── server ──────────────────────────────────────────────
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        shard = None
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:           # longer than STREAM_LIMIT; readline has dropped it
+                    logger.error("Oversized message from worker %s dropped", shard)
+                    continue
+                if not line:
+                    break
+                op = req_id = None
+                try:
+                    msg = loads(line)
+                    op = msg.pop("op")
+                    req_id = msg.pop("id", None)
+                    if op == "hello":
+                        shard = msg["shard"]
+                        result = self.op_hello(shard, writer)
+                    else:
+                        result = getattr(self, f"op_{op}")(**msg)
+                except Exception as exc:
+                    logger.exception("Request from worker %s failed: %.200s", shard, line)
+                    reply = {"id": req_id, "error": f"{type(exc).__name__}: {exc}"}
+                else:
+                    reply = {"id": req_id, "result": result}
+                if req_id is not None:
+                    writer.write(_encode(reply))
+                if op == "hello" and "result" in reply:
+                    self._flush_backlog(shard, writer)    # after the replica, so it applies first
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if shard is not None and self.workers.get(shard) is writer:
+                del self.workers[shard]
+                logger.warning("Worker %d disconnected", shard)
+            writer.close()
+
+    async def serve(self, path: str = SOCKET_PATH):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.load()
+        if self.store:
+            self._store_task = asyncio.create_task(self.store.run())
+        return await asyncio.start_unix_server(self.handle, path=path, limit=STREAM_LIMIT)
+
+    async def close(self):
+        """Stop the write-behind task and commit whatever it had not flushed yet."""
+        if self._store_task:
+            self.store.stop()
+            await asyncio.gather(self._store_task, return_exceptions=True)
+            self._store_task = None
+        if self.store:
+            self.store.close()
+
+
+# ─────────────  worker side  ─────────────
+class ShardError(Exception):
+    """The coordinator could not serve a ``call`` (op failed or connection lost)."""
+
+
+class ShardClient:
+    """Worker's connection to the coordinator.
+
+    ``call`` is a request/reply RPC; events update the replicas through the
+    callbacks passed to ``connect`` and routed updates go to ``on_update``.
+    When the connection drops, every pending ``call`` fails with ShardError
+    and ``on_lost`` runs; the worker then exits and the supervisor starts a
+    fresh one, which gets a full replica on hello.
+    """
+
+    def __init__(self, shard: int, path: str = SOCKET_PATH):
+        self.shard = shard
+        self.path = path
+        self._ids = itertools.count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task = None
+        self._handlers: dict = {}
+        self.connected = False
+
+    async def connect(self, on_event, on_update, on_lost=None):
+        reader, self._writer = await asyncio.open_unix_connection(self.path, limit=STREAM_LIMIT)
+        self._handlers = {"event": on_event, "update": on_update, "lost": on_lost}
+        self.connected = True
+        self._reader_task = asyncio.create_task(self._read(reader))
+        return await self.call("hello", shard=self.shard)
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._writer:
+            self._writer.close()
+
+    async def _read(self, reader):
+        try:
+            while line := await reader.readline():
+                try:
+                    await self._dispatch(loads(line))
+                except Exception:
+                    logger.exception("Bad message from coordinator: %.200s", line)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as exc:
+            logger.error("Coordinator connection failed: %s", exc)
+        finally:
+            self.connected = False
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(ShardError("coordinator connection lost"))
+            self._pending.clear()
+        logger.error("Coordinator connection closed")
+        if self._handlers.get("lost"):
+            self._handlers["lost"]()
+
+    async def _dispatch(self, msg: dict):
+        if "id" in msg:
+            fut = self._pending.pop(msg["id"], None)
+            if fut and not fut.done():
+                if "error" in msg:
+                    fut.set_exception(ShardError(msg["error"]))
+                else:
+                    fut.set_result(msg["result"])
+        elif msg["ev"] == "update":
+            await self._handlers["update"](msg["data"])
+        else:
+            self._handlers["event"](msg)
+
+    async def call(self, op: str, **kwargs):
+        if not self.connected:
+            raise ShardError("not connected to the coordinator")
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        try:
+            await _send(self._writer, {"op": op, "id": req_id, **kwargs})
+        except ConnectionError as exc:
+            self._pending.pop(req_id, None)
+            raise ShardError("coordinator connection lost") from exc
+        return await fut
+
+    def cast(self, op: str, **kwargs):
+        """Fire-and-forget request (reply, if any, is ignored)."""
+        self._writer.write(_encode({"op": op, **kwargs}))
+
+
+class ShardWaitSet:
+    """Worker-local view of the coordinator's wait-pool.
+
+    Tracks which of *this worker's* users are searching, so membership checks
+    in handlers stay local; removals are forwarded to the coordinator.
+    """
+
+    def __init__(self, client: ShardClient):
+        self.client = client
+        self._local: set[int] = set()
+
+    def __len__(self):
+        return len(self._local)
+
+    def __contains__(self, uid):
+        return uid in self._local
+
+    def __iter__(self):
+        return iter(tuple(self._local))
+
+    def add(self, uid, language=None, gender=None):
+        self._local.add(uid)
+
+    def discard(self, uid):
+        self._local.discard(uid)
+
+    def remove(self, uid) -> bool:
+        if uid not in self._local:
+            return False
+        self._local.discard(uid)
+        self.client.cast("cancel", uid=uid)
+        return True
+
+
+# ─────────────  router / supervisor  ─────────────
+def update_owner(update: dict) -> int | None:
+    """User id of a raw update without building a telegram.Update."""
+    for key, value in update.items():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user") or {}
+            if "id" in sender:
+                return sender["id"]
+            chat = value.get("chat") or {}
+            if "id" in chat:
+                return chat["id"]
+    return None
+
+
+async def poll_updates(token: str, coordinator: Coordinator, workers: int):
+    from telegram import Bot, Update
+
+    async with Bot(token) as bot:
+        await bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=25, allowed_updates=Update.ALL_TYPES)
+            except Exception:
+                logger.exception("getUpdates failed")
+                await asyncio.sleep(1)
+                continue
+            for upd in updates:
+                offset = upd.update_id + 1
+                data = upd.to_dict()
+                owner = update_owner(data)
+                coordinator.route((owner or 0) % workers, data)
+
+
+def start_worker(shard: int, workers: int) -> subprocess.Popen:
+    env = dict(os.environ, BOT_MODE="shard", SHARD_ID=str(shard), SHARD_COUNT=str(workers), SHARD_SOCKET=SOCKET_PATH,
+               DB_PATH=f"gabbar-{shard}.db", JOURNAL_DIR=f"journal-{shard}")
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), "demo.py")], env=env)
+
+
+async def keep_workers_running(procs: list[subprocess.Popen]):
+    """Restart any worker that exits; its updates wait in the coordinator's backlog meanwhile."""
+    while True:
+        await asyncio.sleep(RESTART_DELAY)
+        for shard, proc in enumerate(procs):
+            if proc.poll() is not None:
+                logger.warning("Worker %d exited with status %s, restarting", shard, proc.returncode)
+                procs[shard] = start_worker(shard, len(procs))
+
+
+async def supervise(workers: int, token: str):
+    coordinator = Coordinator(os.getenv("COORDINATOR_DB", "gabbar-coordinator.db"))
+    server = await coordinator.serve(SOCKET_PATH)
+    procs = [start_worker(shard, workers) for shard in range(workers)]
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    watchdog = asyncio.create_task(keep_workers_running(procs))
+    stopping = asyncio.create_task(stop.wait())
+    joined = asyncio.create_task(coordinator.wait_for_workers(workers))
+    await asyncio.wait((joined, stopping), return_when=asyncio.FIRST_COMPLETED)
+    joined.cancel()
+
+    poller = None
+    if not stop.is_set():
+        poller = asyncio.create_task(poll_updates(token, coordinator, workers))
+        print(f"✅ Coordinator up with {workers} workers")
+        await stopping
+
+    watchdog.cancel()
+    if poller:
+        poller.cancel()
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        proc.wait()
+    server.close()
+    await coordinator.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run Gabbar Chat as N worker processes + coordinator")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    asyncio.run(supervise(args.workers, os.environ["BOT_TOKEN"]))
@@ -0,0 +1,351 @@
+# Durable state for Gabbar Chat Bot.
+# The module-level dicts in demo.py stay the hot cache.  StateStore mirrors
+# them into SQLite (WAL) with write-behind batching; Journal keeps an
+# append-only mutation log plus periodic snapshots for fast restarts.
+
+import asyncio
+import json
+import logging
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TABLES = ("users", "active_chats", "reports", "blocked_users")
+SNAPSHOT_CHUNK = 5000     # list items per pickle in a snapshot (see Journal.snapshot_bytes)
+
+_DELETE = object()
+
+
+async def _pause(stop: asyncio.Event, seconds: float):
+    """Sleep ``seconds``, or less if ``stop`` gets set."""
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+def _encode(obj):
+    if isinstance(obj, datetime):
+        return {"$dt": obj.isoformat()}
+    raise TypeError(f"Cannot persist {type(obj).__name__}")
+
+
+def _decode(d):
+    if len(d) == 1 and "$dt" in d:
+        return datetime.fromisoformat(d["$dt"])
+    return d
+
+
+def dumps(value) -> str:
+    return json.dumps(value, default=_encode, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(text: str):
+    return json.loads(text, object_hook=_decode)
+
+
+class StateStore:
+    """Write-behind key/value store, one SQLite table per piece of bot state.
+
+    ``put``/``delete`` are O(1) dict writes and never touch disk.  ``run``
+    serialises the dirty keys on the event loop every ``flush_ms`` and hands
+    the batch to a worker thread, which commits it in one transaction.
+    ``get`` reads one key through a separate connection (WAL readers never
+    wait for the writer), seeing pending writes first.
+    """
+
+    def __init__(self, path: str, flush_ms: int = 200):
+        self.path = path
+        self.flush_ms = flush_ms
+        self._conn: sqlite3.Connection | None = None
+        self._reader: sqlite3.Connection | None = None
+        self._dirty: dict[str, dict] = {t: {} for t in TABLES}
+        self._retry: dict[str, dict] = {}      # serialised rows of a failed flush
+        self._inflight: dict[str, dict] = {}   # serialised rows being committed right now
+        self._stop = asyncio.Event()
+
+    # ── lifecycle ───────────────────────────────────────────
+    def open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for table in TABLES:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+        self._conn.commit()
+        self._reader = sqlite3.connect(self.path, check_same_thread=False)
+
+    def load(self, skip=()) -> dict[str, dict]:
+        """Read every table back as ``{table: {key: value}}`` (tables in ``skip`` come back empty)."""
+        state = {}
+        for table in TABLES:
+            rows = () if table in skip else self._conn.execute(f"SELECT k, v FROM {table}")
+            state[table] = {loads(k): loads(v) for k, v in rows}
+        return state
+
+    def count(self, table: str, where: str = "1", params=()) -> int:
+        """Committed rows matching an SQL condition on ``k`` / ``v`` (json_extract works on ``v``)."""
+        return self._reader.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params).fetchone()[0]
+
+    def flush(self):
+        """Commit everything pending synchronously (startup / shutdown only)."""
+        self._write(self._take_batch())
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        self._reader.close()
+        self._conn.close()
+        self._conn = self._reader = None
+
+    # ── hot path ────────────────────────────────────────────
+    def put(self, table: str, key, value):
+        """Mark ``key`` dirty; ``value`` is serialised at the next flush."""
+        self._dirty[table][key] = value
+
+    def delete(self, table: str, key):
+        self._dirty[table][key] = _DELETE
+
+    def get(self, table: str, key):
+        """Current value of ``key`` (pending writes win over disk), or None."""
+        value = self._dirty[table].get(key)
+        if value is not None:
+            return None if value is _DELETE else value
+        k = dumps(key)
+        for batch in (self._inflight, self._retry):
+            rows = batch.get(table)
+            if rows and k in rows:
+                return None if rows[k] is None else loads(rows[k])
+        row = self._reader.execute(f"SELECT v FROM {table} WHERE k = ?", (k,)).fetchone()
+        return None if row is None else loads(row[0])
+
+    def is_pending(self, table: str, key) -> bool:
+        """True until the latest write to ``key`` is committed."""
+        if key in self._dirty[table]:
+            return True
+        k = dumps(key)
+        return any(k in batch.get(table, ()) for batch in (self._inflight, self._retry))
+
+    @property
+    def pending(self) -> int:
+        return sum(len(d) for d in self._dirty.values())
+
+    # ── group commit ────────────────────────────────────────
+    def _take_batch(self):
+        batch, self._retry = self._retry, {}
+        for table, dirty in self._dirty.items():
+            if dirty:
+                rows = batch.setdefault(table, {})
+                for k, v in dirty.items():
+                    rows[dumps(k)] = None if v is _DELETE else dumps(v)
+                self._dirty[table] = {}
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._conn:
+            for table, rows in batch.items():
+                self._conn.executemany(f"DELETE FROM {table} WHERE k = ?",
+                                       [(k,) for k, v in rows.items() if v is None])
+                self._conn.executemany(f"INSERT OR REPLACE INTO {table} (k, v) VALUES (?, ?)",
+                                       [(k, v) for k, v in rows.items() if v is not None])
+
+    def stop(self):
+        """Make ``run`` return once the commit in progress is done; await it before ``close``.
+
+        Cancelling ``run`` instead would leave its writer thread using the
+        connection that ``close`` flushes and closes.
+        """
+        self._stop.set()
+
+    async def run(self):
+        while not self._stop.is_set():
+            await _pause(self._stop, self.flush_ms / 1000)
+            batch = self._take_batch()
+            if not batch:
+                continue
+            self._inflight = batch
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                logger.exception("State flush failed, retrying with the next batch")
+                for table, rows in batch.items():
+                    self._retry.setdefault(table, {}).update(rows)
+            finally:
+                self._inflight = {}
+
+
+class Journal:
+    """Append-only log of state mutations plus a periodic binary snapshot.
+
+    Every ``append`` pickles one ``(op, args)`` record into an in-memory
+    buffer; ``run`` writes the buffer out every ``flush_ms`` and, every
+    ``snapshot_sec``, pickles the whole state into ``snapshot.bin`` and
+    truncates the journal.  The state is copied on the event loop and
+    pickled in a worker thread, in chunks, so a big history doesn't stall
+    the loop.  ``recover`` mmaps the snapshot and returns only
+    the journal tail written after it, so a cold start replays seconds of
+    history instead of everything.
+
+    Record layout: ``<payload length:u32> <crc32:u32> <seq:u64> <pickle>``.
+    A torn or corrupt record ends the replay.
+    """
+
+    HEADER = struct.Struct("<IIQ")
+
+    def __init__(self, directory: str, flush_ms: int = 50, snapshot_sec: int = 300):
+        self.directory = directory
+        self.journal_path = os.path.join(directory, "journal.bin")
+        self.snapshot_path = os.path.join(directory, "snapshot.bin")
+        self.flush_ms = flush_ms
+        self.snapshot_sec = snapshot_sec
+        self.seq = 0
+        self._buf: list[bytes] = []
+        self._fh = None
+        self._stop = asyncio.Event()
+
+    # ── lifecycle ───────────────────────────────────────────
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._fh = open(self.journal_path, "ab")
+
+    def close(self):
+        if self._fh is None:
+            return
+        data = self._take()
+        if data:
+            self._write_journal(data)
+        self._fh.close()
+        self._fh = None
+
+    def recover(self):
+        """Return ``(snapshot_state or None, [(op, args), …])`` and resume ``seq``."""
+        state, snap_seq = None, 0
+        with _mapped(self.snapshot_path) as mm:
+            if mm is not None:
+                snap_seq, state = self._load_snapshot(mm)
+
+        tail, last_seq = [], snap_seq
+        with _mapped(self.journal_path) as mm:
+            pos = 0
+            while mm is not None and pos + self.HEADER.size <= len(mm):
+                length, crc, seq = self.HEADER.unpack_from(mm, pos)
+                start, pos = pos + self.HEADER.size, pos + self.HEADER.size + length
+                payload = mm[start:pos]
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    logger.warning("Journal truncated at offset %d (torn record)", start - self.HEADER.size)
+                    break
+                if seq > snap_seq:
+                    tail.append(pickle.loads(payload))
+                    last_seq = seq
+
+        self.seq = last_seq
+        return state, tail
+
+    # ── hot path ────────────────────────────────────────────
+    def append(self, op: str, *args):
+        self.seq += 1
+        payload = pickle.dumps((op, args), protocol=5)
+        self._buf.append(self.HEADER.pack(len(payload), zlib.crc32(payload), self.seq) + payload)
+
+    # ── background writer ───────────────────────────────────
+    def _take(self) -> bytes:
+        buf, self._buf = self._buf, []
+        return b"".join(buf)
+
+    def snapshot_bytes(self, state: dict, seq: int | None = None) -> bytes:
+        """``(seq, state minus lists, {key: chunk count})``, then each list as SNAPSHOT_CHUNK-item pickles.
+
+        One pickle.dumps holds the GIL for its whole run, so a long report
+        list pickled in one go would stall the event loop even from a worker
+        thread; between chunks the loop gets the GIL back.
+        """
+        head = {k: v for k, v in state.items() if not isinstance(v, list)}
+        chunks = {k: range(0, len(v), SNAPSHOT_CHUNK) for k, v in state.items() if isinstance(v, list)}
+        parts = [pickle.dumps((self.seq if seq is None else seq, head, {k: len(r) for k, r in chunks.items()}),
+                              protocol=5)]
+        for key, starts in chunks.items():
+            parts += [pickle.dumps(state[key][i:i + SNAPSHOT_CHUNK], protocol=5) for i in starts]
+        return b"".join(parts)
+
+    @staticmethod
+    def _load_snapshot(mm) -> tuple[int, dict]:
+        head = pickle.load(mm)         # each part has its own memo, so one load() per part
+        if len(head) == 2:             # single-pickle snapshot from before chunking
+            return head
+        seq, state, chunks = head
+        for key, n in chunks.items():
+            state[key] = [item for _ in range(n) for item in pickle.load(mm)]
+        return seq, state
+
+    def _write_journal(self, data: bytes):
+        self._fh.write(data)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def _write_snapshot(self, snapshot: bytes):
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        # everything written so far is covered by the snapshot
+        self._fh.truncate(0)
+
+    def write_snapshot(self, state):
+        """Synchronously snapshot ``state`` (used once at startup)."""
+        snapshot = self.snapshot_bytes(state)
+        self._take()
+        self._write_snapshot(snapshot)
+
+    def stop(self):
+        """Make ``run`` return once the write in progress is done; await it before ``close``.
+
+        A cancelled ``run`` could leave a snapshot thread truncating the
+        journal after ``close`` wrote its last records.
+        """
+        self._stop.set()
+
+    async def run(self, get_state):
+        """``get_state()`` must return a copy that later mutations on the loop don't touch."""
+        last_snapshot = time.monotonic()
+        while not self._stop.is_set():
+            await _pause(self._stop, self.flush_ms / 1000)
+            state = seq = None
+            if time.monotonic() - last_snapshot >= self.snapshot_sec:
+                state, seq = get_state(), self.seq     # consistent with the records _take() gets below
+                last_snapshot = time.monotonic()
+            data = self._take()
+            try:
+                if data:
+                    await asyncio.to_thread(self._write_journal, data)
+            except Exception:
+                logger.exception("Journal write failed, retrying with the next batch")
+                self._buf.insert(0, data)
+                continue
+            try:
+                if state is not None:
+                    snapshot = await asyncio.to_thread(self.snapshot_bytes, state, seq)
+                    await asyncio.to_thread(self._write_snapshot, snapshot)
+            except Exception:
+                logger.exception("Snapshot write failed, journal keeps growing until the next one")
+
+
+@contextmanager
+def _mapped(path: str):
+    """Read-only mmap of ``path`` (None when missing or empty)."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        yield None
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield mm
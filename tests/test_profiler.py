@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiler import ProfileResult, SamplingProfiler  # noqa: E402
+
+
+def spin(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+async def busy_handler(seconds: float):
+    spin(seconds)
+
+
+async def profile_busy_handler(results: list):
+    profiler = SamplingProfiler(os.path.abspath(__file__), interval=0.002)
+    sampling = asyncio.create_task(profiler.profile(0.3))
+    await asyncio.sleep(0.02)                        # let the sampler thread start
+    await asyncio.create_task(busy_handler(0.4))     # its own task, like a PTB handler
+    results.append(await sampling)
+
+
+async def profile_through_processor(results: list):
+    # demo builds its stores at import time; keep them out of the working tree
+    tmp = tempfile.mkdtemp(prefix="gabbar-test-")
+    os.environ.setdefault("DB_PATH", os.path.join(tmp, "test.db"))
+    os.environ.setdefault("JOURNAL_DIR", os.path.join(tmp, "journal"))
+    import demo
+    from telegram import Chat, Message, Update, User
+
+    async def slow_relay(msg, partner_id, bot):
+        spin(0.4)
+
+    demo.relay_message = slow_relay            # the handler's own work, outside demo.py
+    demo.active_chats.update({1: 2, 2: 1})
+    message = Message(1, datetime.now(), Chat(1, Chat.PRIVATE), from_user=User(1, "u", False), text="hi")
+    update = Update(1, message=message)
+    context = SimpleNamespace(bot=None)
+
+    processor = demo.ChatOrderedProcessor(4)
+    sampling = asyncio.create_task(demo.profiler.profile(0.3))
+    await asyncio.sleep(0.02)
+    await asyncio.create_task(processor.process_update(update, demo.message_handler(update, context)))
+    results.append(await sampling)
+
+
+class ProfileSummaryTest(unittest.TestCase):
+    def test_busy_handler_owns_its_samples(self):
+        results = []
+        # run the loop in a thread whose root frames are not in this file, as
+        # the bot's loop only has demo.py's <module> at the root
+        thread = threading.Thread(target=asyncio.run, args=(profile_busy_handler(results),))
+        thread.start()
+        thread.join()
+        result = results[0]
+
+        by_handler = result.summary().split("By handler:")[1].split("Hottest")[0]
+        self.assertIn("busy_handler", by_handler)
+        self.assertNotIn("<module>", by_handler)
+        top_line = by_handler.strip().splitlines()[0]
+        self.assertTrue(top_line.endswith("busy_handler"), top_line)
+
+    def test_concurrent_updates_charge_the_handler(self):
+        results = []
+        thread = threading.Thread(target=asyncio.run, args=(profile_through_processor(results),))
+        thread.start()
+        thread.join()
+
+        by_handler = results[0].summary().split("By handler:")[1].split("Hottest")[0]
+        self.assertNotIn("process_update", by_handler)
+        top_line = by_handler.strip().splitlines()[0]
+        self.assertTrue(top_line.endswith("message_handler"), top_line)
+
+    def test_module_frame_is_not_an_owner(self):
+        module_code = compile("pass", os.path.abspath(__file__), "exec")
+        res = ProfileResult({}, 0, 0.0, os.path.abspath(__file__))
+        # leaf first, root last
+        self.assertEqual(res._owner((spin.__code__, busy_handler.__code__, module_code)), "busy_handler")
+        self.assertEqual(res._owner((module_code,)), "<framework>")
+
+
+if __name__ == "__main__":
+    unittest.main()
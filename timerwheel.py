@@ -0,0 +1,53 @@
+# Hashed timing wheel for Gabbar Chat Bot.
+#
+# ``slots`` buckets, each covering ``tick`` seconds; a timer lands in the
+# bucket of its deadline tick.  schedule() and cancel() are dict operations,
+# and advance() only visits the buckets whose tick has passed.  Timers more
+# than one revolution out carry a count of rounds still to wait (Varghese &
+# Lauck's scheme 6), so any delay works; size the wheel to the usual delay to
+# keep that count at zero.
+
+import math
+
+
+class TimerWheel:
+    def __init__(self, tick: float, slots: int, now: float):
+        self.tick = tick
+        self._slots: list[dict] = [{} for _ in range(slots)]   # key → rounds left
+        self._where: dict = {}                                 # key → slot index
+        self._cursor = int(now // tick)                        # last tick processed
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def schedule(self, key, at: float):
+        """(Re)arm ``key`` to fire at ``at`` (rounded up to the next tick)."""
+        self.cancel(key)
+        ticks = max(1, math.ceil(at / self.tick) - self._cursor)
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot][key] = (ticks - 1) // len(self._slots)
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now: float) -> list:
+        """Move the wheel up to ``now``; return the keys whose time has come."""
+        due = []
+        target = int(now // self.tick)
+        while self._cursor < target:
+            self._cursor += 1
+            bucket = self._slots[self._cursor % len(self._slots)]
+            for key, rounds in list(bucket.items()):
+                if rounds:
+                    bucket[key] = rounds - 1
+                else:
+                    del bucket[key]
+                    del self._where[key]
+                    due.append(key)
+        return due
@@ -0,0 +1,91 @@
+# In-memory time-series rollups for Gabbar Chat Bot.
+#
+# Every Series keeps one fixed ring of buckets per resolution: the last 60
+# minutes, 48 hours and 30 days.  A bucket holds a count and a sum, which is
+# enough for totals, rates and means.  record() touches one bucket per ring
+# and resets it lazily when its slot comes round again, so recording is O(1)
+# and memory never grows.  Buckets are aligned to UTC wall-clock time.
+#
+# Rings pickle cleanly, so the bot keeps its rollups across restarts by
+# putting them in the journal snapshot.
+
+import time
+from array import array
+
+RESOLUTIONS = {"minute": (60, 60), "hour": (3600, 48), "day": (86400, 30)}   # width s, buckets
+
+
+class Ring:
+    __slots__ = ("width", "epochs", "counts", "sums")
+
+    def __init__(self, width: int, buckets: int):
+        self.width = width
+        self.epochs = array("q", [-1]) * buckets      # which width-long period each slot holds
+        self.counts = array("q", [0]) * buckets
+        self.sums = array("d", [0.0]) * buckets
+
+    def add(self, now: float, value: float, count: int):
+        epoch = int(now // self.width)
+        i = epoch % len(self.epochs)
+        if self.epochs[i] != epoch:
+            self.epochs[i], self.counts[i], self.sums[i] = epoch, 0, 0.0
+        self.counts[i] += count
+        self.sums[i] += value
+
+    def points(self, now: float, n: int) -> list[tuple[int, int, float]]:
+        """``(bucket start, count, sum)`` for the last ``n`` buckets, oldest first."""
+        current = int(now // self.width)
+        out = []
+        for epoch in range(current - n + 1, current + 1):
+            i = epoch % len(self.epochs)
+            if self.epochs[i] == epoch:
+                out.append((epoch * self.width, self.counts[i], self.sums[i]))
+            else:
+                out.append((epoch * self.width, 0, 0.0))
+        return out
+
+
+class Series:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.rings = {res: Ring(width, n) for res, (width, n) in RESOLUTIONS.items()}
+
+    def record(self, value: float = 1.0, count: int = 1, now: float | None = None):
+        """Add ``value`` to the sum and ``count`` to the count of the current buckets."""
+        now = time.time() if now is None else now
+        for ring in self.rings.values():
+            ring.add(now, value, count)
+
+    def points(self, resolution: str, n: int, now: float | None = None):
+        return self.rings[resolution].points(time.time() if now is None else now, n)
+
+    def window(self, seconds: int, now: float | None = None) -> tuple[int, float]:
+        """``(count, sum)`` over the last ``seconds``, read from the finest ring that covers it."""
+        for ring in self.rings.values():
+            if ring.width * len(ring.epochs) >= seconds:
+                pts = ring.points(time.time() if now is None else now, max(1, seconds // ring.width))
+                return sum(p[1] for p in pts), sum(p[2] for p in pts)
+        raise ValueError(f"no ring covers {seconds}s")
+
+
+class TimeSeries:
+    """Named Series; pickled as a whole into the snapshot."""
+
+    def __init__(self):
+        self._series: dict[str, Series] = {}
+
+    def series(self, name: str, help_text: str) -> Series:
+        s = self._series.get(name)
+        if s is None:
+            s = self._series[name] = Series(name, help_text)
+        return s
+
+    def __iter__(self):
+        return iter(self._series.values())
+
+    def restore(self, other: "TimeSeries"):
+        """Take over the rings of a snapshot's series in place (Series objects stay the same)."""
+        for name, old in other._series.items():
+            if name in self._series:
+                self._series[name].rings = old.rings